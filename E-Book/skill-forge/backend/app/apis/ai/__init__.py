@@ -1,13 +1,38 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict
+import asyncio
+import functools
+import logging
+import time
+import os
 import databutton as db
-from openai import OpenAI
 
-# 1. Initialize router and OpenAI client
+from app.libs.metrics import AI_UPSTREAM_ERRORS, AI_UPSTREAM_SECONDS
+
+# 1. Initialize router, the OpenAI client is created on first use
 router = APIRouter()
-# The API key is securely stored in Databutton secrets, not in the code.
-client = OpenAI(api_key=db.secrets.get("OPENAI_API_KEY"), base_url="https://api.perplexity.ai")
+logger = logging.getLogger(__name__)
+
+@functools.cache
+def get_client():
+    # Imported here so the openai package doesn't weigh on app startup
+    from openai import OpenAI
+
+    # The API key is securely stored in Databutton secrets, not in the code.
+    # Both can be overridden from the environment, e.g. to use a local stub.
+    return OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY") or db.secrets.get("OPENAI_API_KEY"),
+        base_url=os.environ.get("OPENAI_BASE_URL", "https://api.perplexity.ai"),
+    )
+
+def create_completion(messages: List[Dict[str, str]]):
+    # Runs in a thread: on first use get_client() imports openai and reads the
+    # secret, which must not block the event loop either
+    return get_client().chat.completions.create(
+        model="gpt-4o-mini",  # Using the specified model
+        messages=messages,
+    )
 
 # 2. Define Pydantic models for request and response
 class AskAIRequest(BaseModel):
@@ -25,17 +50,18 @@ async def ask_ai(request: AskAIRequest):
     if not request.messages:
         raise HTTPException(status_code=400, detail="The 'messages' field is required.")
 
+    started = time.perf_counter()
     try:
-        # 4. Call the OpenAI API
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",  # Using the specified model
-            messages=request.messages,
-        )
-        
+        # 4. Call the OpenAI API, in a thread as the client is synchronous
+        completion = await asyncio.to_thread(create_completion, request.messages)
+        AI_UPSTREAM_SECONDS.labels("ok").observe(time.perf_counter() - started)
+
         ai_response = completion.choices[0].message.content
         return AskAIResponse(content=ai_response)
 
     except Exception as e:
         # 5. Handle potential errors from the API call
-        print(f"An error occurred: {e}")
+        AI_UPSTREAM_SECONDS.labels("error").observe(time.perf_counter() - started)
+        AI_UPSTREAM_ERRORS.labels(type(e).__name__).inc()
+        logger.error("An error occurred calling the AI service: %s", e)
         raise HTTPException(status_code=500, detail="Failed to get a response from the AI service.")
@@ -1,10 +1,14 @@
-import databutton as db
+import json
+
 import asyncpg
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 
 from app.auth import AuthorizedUser
+from app.libs.database import Intent, ReadConnection, WriteConnection, connection
+from app.libs.score_distribution import distributions
+from app.libs.task_queue import task
 
 router = APIRouter()
 
@@ -69,87 +73,153 @@ class SubmitAnswerRequest(BaseModel):
     question_id: int
     answer_index: int
 
+class FinalizeAssessment(BaseModel):
+    assessment_id: int
+
+
+# --- Helper Functions ---
+def parse_options(options) -> List[str]:
+    # Stored as a JSON string, decoded already if the column is json typed
+    return json.loads(options) if isinstance(options, str) else options
+
+
+# --- Background Tasks ---
+@task("assessments.finalize", queue="assessments")
+async def finalize_assessment(payload: FinalizeAssessment) -> None:
+    """Calculates the score of a fully answered assessment and completes it."""
+    async with connection(Intent.WRITE) as conn:
+        async with conn.transaction():
+            assessment_id = payload.assessment_id
+            total_questions = await conn.fetchval("SELECT COUNT(*) FROM assessment_items WHERE assessment_id = $1", assessment_id)
+            correct_answers = await conn.fetchval("SELECT COUNT(*) FROM assessment_items WHERE assessment_id = $1 AND is_correct = true", assessment_id)
+            score = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
+
+            skill_name = await conn.fetchval(
+                "UPDATE assessments SET status = 'completed', score = $1, completed_at = NOW() WHERE id = $2 AND status = 'grading' RETURNING skill_name",
+                score, assessment_id
+            )
 
-# --- Database Connection ---
-async def get_db_connection():
-    try:
-        conn = await asyncpg.connect(db.secrets.get("DATABASE_URL_DEV"))
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Could not connect to the database.")
+    if skill_name is not None:
+        distributions.record(skill_name, score)
 
 
 # --- API Endpoints ---
 @router.post("/assessments", response_model=AssessmentState, status_code=201)
-async def start_assessment(request: StartAssessmentRequest, user: AuthorizedUser):
+async def start_assessment(request: StartAssessmentRequest, user: AuthorizedUser, conn: WriteConnection):
     """Starts a new assessment for a given skill."""
     skill_name = request.skill_name
     if skill_name not in QUESTION_BANK:
         raise HTTPException(status_code=404, detail="No assessment available for this skill.")
 
     questions = QUESTION_BANK[skill_name]
-    conn = await get_db_connection()
-    try:
-        async with conn.transaction():
-            # Create the main assessment record
-            assessment_record = await conn.fetchrow(
-                "INSERT INTO assessments (user_id, skill_name) VALUES ($1, $2) RETURNING id, status, skill_name",
-                user.sub,
-                skill_name,
+    async with conn.transaction():
+        # Create the main assessment record
+        assessment_record = await conn.fetchrow(
+            "INSERT INTO assessments (user_id, skill_name) VALUES ($1, $2) RETURNING id, status, skill_name",
+            user.sub,
+            skill_name,
+        )
+        assessment_id = assessment_record['id']
+
+        # Add questions to the assessment_items table
+        for q in questions:
+            await conn.execute(
+                """
+                INSERT INTO assessment_items (assessment_id, question_text, options, correct_answer_index)
+                VALUES ($1, $2, $3, $4)
+                """,
+                assessment_id,
+                q["question_text"],
+                json.dumps(q["options"]),  # Storing as JSON string
+                q["correct_answer_index"],
             )
-            assessment_id = assessment_record['id']
-
-            # Add questions to the assessment_items table
-            for q in questions:
-                await conn.execute(
-                    """
-                    INSERT INTO assessment_items (assessment_id, question_text, options, correct_answer_index)
-                    VALUES ($1, $2, $3, $4)
-                    """,
-                    assessment_id,
-                    q["question_text"],
-                    str(q["options"]),  # Storing as JSON string
-                    q["correct_answer_index"],
-                )
-
-        first_question_record = await conn.fetchrow(
-            "SELECT id, question_text, options FROM assessment_items WHERE assessment_id = $1 ORDER BY id ASC LIMIT 1",
-            assessment_id
+
+    first_question_record = await conn.fetchrow(
+        "SELECT id, question_text, options FROM assessment_items WHERE assessment_id = $1 ORDER BY id ASC LIMIT 1",
+        assessment_id
+    )
+
+    return AssessmentState(
+        id=assessment_id,
+        status=assessment_record['status'],
+        skill_name=assessment_record['skill_name'],
+        next_question=AssessmentQuestion(
+            id=first_question_record['id'],
+            question_text=first_question_record['question_text'],
+            options=parse_options(first_question_record['options'])
         )
+    )
+
+
+async def load_assessment_state(conn: asyncpg.Connection, assessment_id: int, user_id: str) -> AssessmentState:
+    assessment_record = await conn.fetchrow(
+        "SELECT id, user_id, status, skill_name, score FROM assessments WHERE id = $1", assessment_id
+    )
+    if not assessment_record or assessment_record['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail="Assessment not found.")
 
+    if assessment_record['status'] == 'completed':
         return AssessmentState(
-            id=assessment_id,
+            id=assessment_record['id'],
             status=assessment_record['status'],
             skill_name=assessment_record['skill_name'],
-            next_question=AssessmentQuestion(
-                id=first_question_record['id'],
-                question_text=first_question_record['question_text'],
-                options=first_question_record['options']
-            )
+            score=assessment_record['score'],
         )
-    finally:
-        await conn.close()
+
+    next_question_record = await conn.fetchrow(
+        """
+        SELECT id, question_text, options FROM assessment_items
+        WHERE assessment_id = $1 AND user_answer_index IS NULL
+        ORDER BY id ASC LIMIT 1
+        """,
+        assessment_id
+    )
+
+    return AssessmentState(
+        id=assessment_record['id'],
+        status=assessment_record['status'],
+        skill_name=assessment_record['skill_name'],
+        next_question=AssessmentQuestion(
+            id=next_question_record['id'],
+            question_text=next_question_record['question_text'],
+            options=parse_options(next_question_record['options'])
+        ) if next_question_record else None,
+    )
+
 
 @router.get("/assessments/{assessment_id}", response_model=AssessmentState)
-async def get_assessment_state(assessment_id: int, user: AuthorizedUser):
+async def get_assessment_state(assessment_id: int, user: AuthorizedUser, conn: ReadConnection):
     """Gets the current state of an assessment."""
-    conn = await get_db_connection()
-    try:
+    return await load_assessment_state(conn, assessment_id, user.sub)
+
+
+@router.post("/assessments/{assessment_id}/response", response_model=AssessmentState)
+async def submit_answer(assessment_id: int, request: SubmitAnswerRequest, user: AuthorizedUser, conn: WriteConnection):
+    """Submits an answer for a question in an assessment."""
+    async with conn.transaction():
+        # Verify the assessment belongs to the user and is in progress
         assessment_record = await conn.fetchrow(
-            "SELECT id, user_id, status, skill_name, score FROM assessments WHERE id = $1", assessment_id
+            "SELECT id, user_id FROM assessments WHERE id = $1 AND status = 'inprogress'", assessment_id
         )
         if not assessment_record or assessment_record['user_id'] != user.sub:
-            raise HTTPException(status_code=404, detail="Assessment not found.")
-
-        if assessment_record['status'] == 'completed':
-            return AssessmentState(
-                id=assessment_record['id'],
-                status=assessment_record['status'],
-                skill_name=assessment_record['skill_name'],
-                score=assessment_record['score'],
-            )
+            raise HTTPException(status_code=404, detail="Active assessment not found.")
+
+        # Get the question and check if it has already been answered
+        question_record = await conn.fetchrow(
+            "SELECT correct_answer_index, user_answer_index FROM assessment_items WHERE id = $1 AND assessment_id = $2",
+            request.question_id, assessment_id
+        )
+        if not question_record or question_record['user_answer_index'] is not None:
+            raise HTTPException(status_code=400, detail="Question not found or already answered.")
+
+        # Update the user's answer
+        is_correct = request.answer_index == question_record['correct_answer_index']
+        await conn.execute(
+            "UPDATE assessment_items SET user_answer_index = $1, is_correct = $2 WHERE id = $3",
+            request.answer_index, is_correct, request.question_id
+        )
 
+        # Check for the next question
         next_question_record = await conn.fetchrow(
             """
             SELECT id, question_text, options FROM assessment_items
@@ -159,74 +229,16 @@ async def get_assessment_state(assessment_id: int, user: AuthorizedUser):
             assessment_id
         )
 
-        return AssessmentState(
-            id=assessment_record['id'],
-            status=assessment_record['status'],
-            skill_name=assessment_record['skill_name'],
-            next_question=AssessmentQuestion(
-                id=next_question_record['id'],
-                question_text=next_question_record['question_text'],
-                options=next_question_record['options']
-            ) if next_question_record else None,
-        )
-    finally:
-        await conn.close()
-
-
-@router.post("/assessments/{assessment_id}/response", response_model=AssessmentState)
-async def submit_answer(assessment_id: int, request: SubmitAnswerRequest, user: AuthorizedUser):
-    """Submits an answer for a question in an assessment."""
-    conn = await get_db_connection()
-    try:
-        async with conn.transaction():
-            # Verify the assessment belongs to the user and is in progress
-            assessment_record = await conn.fetchrow(
-                "SELECT id, user_id FROM assessments WHERE id = $1 AND status = 'inprogress'", assessment_id
-            )
-            if not assessment_record or assessment_record['user_id'] != user.sub:
-                raise HTTPException(status_code=404, detail="Active assessment not found.")
-
-            # Get the question and check if it has already been answered
-            question_record = await conn.fetchrow(
-                "SELECT correct_answer_index, user_answer_index FROM assessment_items WHERE id = $1 AND assessment_id = $2",
-                request.question_id, assessment_id
-            )
-            if not question_record or question_record['user_answer_index'] is not None:
-                raise HTTPException(status_code=400, detail="Question not found or already answered.")
-
-            # Update the user's answer
-            is_correct = request.answer_index == question_record['correct_answer_index']
+        if not next_question_record:
+            # All questions answered, the score is calculated by a background task
             await conn.execute(
-                "UPDATE assessment_items SET user_answer_index = $1, is_correct = $2 WHERE id = $3",
-                request.answer_index, is_correct, request.question_id
+                "UPDATE assessments SET status = 'grading' WHERE id = $1", assessment_id
             )
-
-            # Check for the next question
-            next_question_record = await conn.fetchrow(
-                """
-                SELECT id, question_text, options FROM assessment_items
-                WHERE assessment_id = $1 AND user_answer_index IS NULL
-                ORDER BY id ASC LIMIT 1
-                """,
-                assessment_id
+            await finalize_assessment.enqueue(
+                conn,
+                FinalizeAssessment(assessment_id=assessment_id),
+                key=f"assessments.finalize:{assessment_id}",
             )
 
-            if not next_question_record:
-                # Assessment is complete, calculate score
-                total_questions = await conn.fetchval("SELECT COUNT(*) FROM assessment_items WHERE assessment_id = $1", assessment_id)
-                correct_answers = await conn.fetchval("SELECT COUNT(*) FROM assessment_items WHERE assessment_id = $1 AND is_correct = true", assessment_id)
-                score = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
-
-                await conn.execute(
-                    "UPDATE assessments SET status = 'completed', score = $1, completed_at = NOW() WHERE id = $2",
-                    score, assessment_id
-                )
-                
-                final_state = await get_assessment_state(assessment_id, user)
-                return final_state
-            
-        # Return the new state with the next question
-        current_state = await get_assessment_state(assessment_id, user)
-        return current_state
-    finally:
-        await conn.close()
+    # Return the new state, read on the same connection so it sees the writes above
+    return await load_assessment_state(conn, assessment_id, user.sub)
@@ -0,0 +1,80 @@
+import datetime
+import logging
+from typing import Optional
+
+import jwt
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from app.libs.badge_credentials import verification_cache, verify_credential
+from app.libs.database import Intent, connection
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Results for badges whose credential is still being signed are only cached briefly
+PENDING_TTL = 5.0
+
+# --- Pydantic Models ---
+class BadgeVerification(BaseModel):
+    badge_id: int
+    valid: bool
+    status: str
+    issuer: Optional[str] = None
+    subject: Optional[str] = None
+    skill_name: Optional[str] = None
+    skill_level: Optional[str] = None
+    issued_at: Optional[datetime.datetime] = None
+
+# --- Helper Functions ---
+def check_credential(badge_id: int, signed_vc_jwt: Optional[str]) -> BadgeVerification:
+    if not signed_vc_jwt:
+        return BadgeVerification(badge_id=badge_id, valid=False, status="pending")
+
+    try:
+        claims = verify_credential(signed_vc_jwt)
+    except jwt.PyJWTError as e:
+        logger.warning("Badge %s failed verification: %s", badge_id, e)
+        return BadgeVerification(badge_id=badge_id, valid=False, status="invalid")
+
+    if claims.get("badge_id") != badge_id:
+        return BadgeVerification(badge_id=badge_id, valid=False, status="invalid")
+
+    skill = claims["vc"]["credentialSubject"]["skill"]
+    return BadgeVerification(
+        badge_id=badge_id,
+        valid=True,
+        status="verified",
+        issuer=claims["iss"],
+        subject=claims["sub"],
+        skill_name=skill["name"],
+        skill_level=skill["level"],
+        issued_at=datetime.datetime.fromtimestamp(claims["iat"], tz=datetime.timezone.utc),
+    )
+
+# --- API Endpoints ---
+@router.get("/badges/{badge_id}/verify", response_model=BadgeVerification)
+async def verify_badge(badge_id: int):
+    """
+    Publicly verifies the signed credential of a badge.
+    Results are cached, so repeated checks of the same badge don't touch the database.
+    """
+    cached = verification_cache.get(badge_id)
+    if cached is not None:
+        return cached
+
+    async with connection(Intent.READ) as conn:
+        badge = await conn.fetchrow(
+            "SELECT signed_vc_jwt FROM badges WHERE id = $1", badge_id
+        )
+    if not badge:
+        raise HTTPException(status_code=404, detail="Badge not found.")
+
+    try:
+        result = check_credential(badge_id, badge['signed_vc_jwt'])
+    except RuntimeError as e:
+        # No signing key configured, don't report (or cache) badges as invalid
+        logger.error("Badge verification unavailable: %s", e)
+        raise HTTPException(status_code=503, detail="Badge verification is temporarily unavailable.")
+    verification_cache.set(badge_id, result, ttl=PENDING_TTL if result.status == "pending" else None)
+    return result
@@ -1,16 +1,20 @@
 
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
+import base64
 import datetime
-import asyncpg
-import databutton as db
 import json
 from app.auth import AuthorizedUser
+from app.libs.database import ReadConnection, WriteConnection
+from app.libs.job_search import SCHEMA_MISSING_ERRORS
 
 router = APIRouter()
 
+# Columns of a Job, without the large search_vector
+JOB_COLUMNS = "j.id, j.org_id, j.title, j.description, j.skill_graph_json, j.location_type, j.status, j.created_at, o.name as org_name"
+
 # --- Pydantic Models ---
 class Job(BaseModel):
     id: int
@@ -30,78 +34,129 @@ class CreateJobRequest(BaseModel):
     skill_graph_json: Dict[str, Any] = Field(..., example={"javascript": "Advanced", "python": "Working"})
     location_type: str = "Remote"
 
+class JobSearchResults(BaseModel):
+    jobs: List[Job]
+    next_cursor: Optional[str] = None
+
+
+# --- Helper Functions ---
+def to_job(job_record) -> Job:
+    job_data = dict(job_record)
+    if isinstance(job_data.get('skill_graph_json'), str):
+        job_data['skill_graph_json'] = json.loads(job_data['skill_graph_json'])
+    return Job(**job_data)
 
-# --- Database Connection ---
-async def get_db_connection():
+def encode_cursor(rank: float, job_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, job_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[float, int]:
     try:
-        return await asyncpg.connect(db.secrets.get("DATABASE_URL_DEV"))
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Could not connect to the database.")
+        rank, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(job_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
 
 # --- API Endpoints ---
 @router.post("/jobs", response_model=Job, status_code=201)
-async def create_job(request: CreateJobRequest, user: AuthorizedUser):
+async def create_job(request: CreateJobRequest, user: AuthorizedUser, conn: WriteConnection):
     """
     Creates a new job posting. 
     (Note: In a real app, this would be restricted to authorized recruiters/orgs)
     """
-    conn = await get_db_connection()
-    try:
-        # For now, we allow any authenticated user to create a job for any org.
-        # This would be locked down in a production environment.
-        org_name = await conn.fetchval("SELECT name FROM orgs WHERE id = $1", request.org_id)
-        if not org_name:
-            raise HTTPException(status_code=404, detail=f"Organization with ID {request.org_id} not found.")
+    # For now, we allow any authenticated user to create a job for any org.
+    # This would be locked down in a production environment.
+    org_name = await conn.fetchval("SELECT name FROM orgs WHERE id = $1", request.org_id)
+    if not org_name:
+        raise HTTPException(status_code=404, detail=f"Organization with ID {request.org_id} not found.")
 
-        job_id = await conn.fetchval(
-            """
-            INSERT INTO jobs (org_id, title, description, skill_graph_json, location_type, status)
-            VALUES ($1, $2, $3, $4, $5, 'open')
-            RETURNING id
-            """,
-            request.org_id,
-            request.title,
-            request.description,
-            request.skill_graph_json,
-            request.location_type
-        )
-        
-        # Fetch the created job to return it
-        new_job_record = await conn.fetchrow("SELECT *, (SELECT name FROM orgs WHERE id = jobs.org_id) as org_name FROM jobs WHERE id = $1", job_id)
-        
-        job_data = dict(new_job_record)
-        if isinstance(job_data.get('skill_graph_json'), str):
-            job_data['skill_graph_json'] = json.loads(job_data['skill_graph_json'])
-
-        return Job(**job_data)
-    finally:
-        await conn.close()
+    job_id = await conn.fetchval(
+        """
+        INSERT INTO jobs (org_id, title, description, skill_graph_json, location_type, status)
+        VALUES ($1, $2, $3, $4, $5, 'open')
+        RETURNING id
+        """,
+        request.org_id,
+        request.title,
+        request.description,
+        request.skill_graph_json,
+        request.location_type
+    )
+    
+    # Fetch the created job to return it
+    new_job_record = await conn.fetchrow(
+        f"SELECT {JOB_COLUMNS} FROM jobs j JOIN orgs o ON j.org_id = o.id WHERE j.id = $1", job_id
+    )
+    return to_job(new_job_record)
 
 @router.get("/jobs", response_model=List[Job])
-async def list_jobs():
+async def list_jobs(conn: ReadConnection):
     """
     Lists all open job postings.
     """
-    conn = await get_db_connection()
+    jobs_records = await conn.fetch(
+        f"""
+        SELECT {JOB_COLUMNS}
+        FROM jobs j
+        JOIN orgs o ON j.org_id = o.id
+        WHERE j.status = 'open'
+        ORDER BY j.created_at DESC
+        """
+    )
+    return [to_job(r) for r in jobs_records]
+
+@router.get("/jobs/search", response_model=JobSearchResults)
+async def search_jobs(
+    conn: ReadConnection,
+    q: str = Query(..., min_length=1, max_length=200),
+    skills: Optional[List[str]] = Query(None),
+    location_type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """
+    Searches open job postings by title and description, ranked by relevance.
+    Titles also match on trigram similarity so small typos still find results.
+    Pass the returned `next_cursor` to fetch the following page.
+    """
+    after_rank, after_id = decode_cursor(cursor) if cursor else (None, None)
+
     try:
-        jobs_records = await conn.fetch(
-            """
-            SELECT j.*, o.name as org_name 
-            FROM jobs j
-            JOIN orgs o ON j.org_id = o.id
-            WHERE j.status = 'open'
-            ORDER BY j.created_at DESC
+        records = await conn.fetch(
             """
+            SELECT * FROM (
+                SELECT j.id, j.org_id, j.title, j.description, j.skill_graph_json,
+                    j.location_type, j.status, j.created_at, o.name as org_name,
+                    ts_rank_cd(j.search_vector, query.tsq) + similarity(j.title, $1) AS rank
+                FROM jobs j
+                JOIN orgs o ON j.org_id = o.id
+                CROSS JOIN (SELECT websearch_to_tsquery('english', $1) AS tsq) query
+                WHERE j.status = 'open'
+                  AND (j.search_vector @@ query.tsq OR j.title % $1)
+                  AND ($2::text[] IS NULL OR j.skill_graph_json::jsonb ?& $2::text[])
+                  AND ($3::text IS NULL OR j.location_type = $3)
+            ) matches
+            WHERE $4::real IS NULL OR (rank, id) < ($4::real, $5::bigint)
+            ORDER BY rank DESC, id DESC
+            LIMIT $6
+            """,
+            q,
+            skills,
+            location_type,
+            after_rank,
+            after_id,
+            limit + 1,
         )
-        
-        job_list = []
-        for job_record in jobs_records:
-            job_data = dict(job_record)
-            if isinstance(job_data.get('skill_graph_json'), str):
-                job_data['skill_graph_json'] = json.loads(job_data['skill_graph_json'])
-            job_list.append(Job(**job_data))
-
-        return job_list
-    finally:
-        await conn.close()
+    except SCHEMA_MISSING_ERRORS:
+        raise HTTPException(status_code=503, detail="Job search is not available yet.")
+
+    page = records[:limit]
+    next_cursor = None
+    if len(records) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last['rank'], last['id'])
+
+    return JobSearchResults(
+        jobs=[to_job(r) for r in page],
+        next_cursor=next_cursor,
+    )
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from app.auth import AuthorizedUser
+from app.libs.profiler import get_admin_users, get_sampler
+
+router = APIRouter()
+
+# --- Pydantic Models ---
+class ProfileSummary(BaseModel):
+    id: int
+    method: str
+    path: str
+    started_at: float
+    duration_ms: float
+    samples: int
+
+# --- Helper Functions ---
+def require_admin(user: AuthorizedUser) -> None:
+    if user.sub not in get_admin_users():
+        raise HTTPException(status_code=403, detail="Profiler access is restricted to admins")
+
+# --- API Endpoints ---
+@router.get("/profiler/profiles", response_model=list[ProfileSummary], dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """
+    Lists the most recent request profiles kept by this process, newest first.
+    """
+    return [profile.summary() for profile in reversed(get_sampler().finished)]
+
+
+@router.get("/profiler/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: int):
+    """
+    Downloads a profile in collapsed stack format, ready for flamegraph.pl or speedscope.
+    """
+    profile = get_sampler().get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return PlainTextResponse(
+        profile.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'},
+    )
@@ -1,15 +1,21 @@
 
 # src/app/apis/telemetry/__init__.py
 
+import asyncio
+import logging
+
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from typing import List, Dict, Any
 
 from app.auth import AuthorizedUser
 from app.libs.anti_cheat_service import analyze_telemetry
+from app.libs.database import Intent, connection
+from app.libs.task_queue import task
 
 # Create a new router for the telemetry API
 router = APIRouter(prefix="/v1/telemetry", tags=["Telemetry"])
+logger = logging.getLogger(__name__)
 
 
 class TelemetryEvent(BaseModel):
@@ -29,6 +35,23 @@ class TelemetryIngestRequest(BaseModel):
     events: List[TelemetryEvent]
 
 
+class TelemetryBatch(BaseModel):
+    """
+    A batch of telemetry events queued for anti-cheat analysis.
+    """
+    user_id: str
+    events: List[TelemetryEvent]
+
+
+@task("telemetry.analyze", queue="telemetry")
+async def analyze_telemetry_batch(payload: TelemetryBatch) -> None:
+    # Convert Pydantic models to dictionaries for the service
+    events_data = [event.model_dump() for event in payload.events]
+
+    # The analysis is CPU bound, keep it off the event loop
+    await asyncio.to_thread(analyze_telemetry, events=events_data)
+
+
 @router.post("/ingest")
 async def ingest_telemetry(
     request: TelemetryIngestRequest,
@@ -41,22 +64,17 @@ async def ingest_telemetry(
     - **request**: A batch of telemetry events.
     - **user**: The authenticated user, provided by the auth dependency.
     """
-    # For now, we will just log that we received the data.
-    # In a future task, this will be stored in the database and
-    # processed by the anti-cheat service.
-    print(
-        f"Received {len(request.events)} telemetry events from user {user.sub}"
+    logger.info(
+        "Received %d telemetry events", len(request.events), extra={"user_id": user.sub, "sample": True}
     )
 
-    # Convert Pydantic models to dictionaries for the service
-    events_data = [event.model_dump() for event in request.events]
-
-    # Call the anti-cheat service to analyze the events
-    analyze_telemetry(events=events_data)
-
-    # In a real implementation, you'd add more logic here, for example:
-    # 1. Validate the event payloads.
-    # 2. Asynchronously write the events to a database (e.g., telemetry_events table).
-    # 3. Trigger an analysis job via the anti-cheat service.
+    # Queue the batch for the anti-cheat service and return immediately,
+    # the analysis runs in a background task worker. Not a WriteConnection:
+    # telemetry is sent continuously and must not keep the user's reads on
+    # the primary.
+    async with connection(Intent.WRITE) as conn:
+        await analyze_telemetry_batch.enqueue(
+            conn, TelemetryBatch(user_id=user.sub, events=request.events)
+        )
 
     return {"status": "ok", "message": f"Successfully ingested {len(request.events)} events."}
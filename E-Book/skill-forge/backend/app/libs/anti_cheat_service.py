@@ -1,7 +1,10 @@
 # src/app/libs/anti_cheat_service.py
 
+import logging
 from typing import List, Dict, Any
 
+logger = logging.getLogger(__name__)
+
 
 def analyze_telemetry(events: List[Dict[str, Any]]):
     """
@@ -15,9 +18,7 @@ def analyze_telemetry(events: List[Dict[str, Any]]):
     Args:
         events: A list of telemetry event dictionaries.
     """
-    print(
-        f"Anti-Cheat Service: Analyzing {len(events)} events."
-    )
+    logger.info("Anti-Cheat Service: Analyzing %d events.", len(events))
 
     # Placeholder for future ML model inference
     # - Feature extraction from raw events
@@ -30,4 +31,4 @@ def analyze_telemetry(events: List[Dict[str, Any]]):
 
     # Example: Log the type of the first event
     first_event_type = events[0].get("event_type", "unknown")
-    print(f"Anti-Cheat Service: First event type is '{first_event_type}'.")
+    logger.debug("Anti-Cheat Service: First event type is '%s'.", first_event_type)
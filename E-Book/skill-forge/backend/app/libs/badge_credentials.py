@@ -0,0 +1,360 @@
+"""Signing and verification of badge verifiable credentials (VC-JWT).
+
+Usage:
+
+    from app.libs.badge_credentials import sign_badge, verify_credential
+
+    token = await sign_badge(badge_id, user_id, skill_name, skill_level, issued_at)
+    claims = verify_credential(token)
+
+The signing key is read once, on first use, from the BADGE_SIGNING_KEY
+environment variable or secret (a PEM encoded Ed25519 or RSA private key).
+Without one, signing and verification fail. For local development set
+BADGE_ALLOW_EPHEMERAL_KEY=1 to generate a throwaway Ed25519 key instead;
+it differs per process and per restart, so badges it signed can only be
+verified by the same process.
+
+Signing runs in an executor so it never blocks the event loop. Concurrent
+callers are batched: every wakeup of the signer hands all pending badges to
+the executor at once. Set BADGE_SIGNING_POOL=process to sign in worker
+processes instead of threads.
+
+Badges are inserted unsigned and signed by the `badges.sign_credential`
+background task, so badges.signed_vc_jwt must be nullable. The one-off
+migration takes care of that:
+
+    python -m app.libs.badge_credentials
+
+Badges still unsigned once their task gave up, e.g. while no key was
+configured, are queued again by a sweep every RESIGN_INTERVAL seconds
+whenever a key is available.
+"""
+
+import asyncio
+import datetime
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+import databutton as db
+import jwt
+
+from app.libs.database import Intent, connection, get_db_connection
+from app.libs.task_queue import NOTIFY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ISSUER = "https://skillforge.app"
+
+MAX_BATCH_SIZE = 256
+
+# The background task signing new badges, see app/apis/badges
+SIGN_TASK = "badges.sign_credential"
+SIGN_QUEUE = "badges"
+
+RESIGN_INTERVAL = 600.0
+
+MIGRATION = "ALTER TABLE badges ALTER COLUMN signed_vc_jwt DROP NOT NULL"
+
+
+@functools.cache
+def get_signing_key_pem() -> bytes:
+    pem = os.environ.get("BADGE_SIGNING_KEY")
+    if not pem:
+        try:
+            pem = db.secrets.get("BADGE_SIGNING_KEY")
+        except Exception:
+            pem = None
+    if pem:
+        return pem.encode()
+
+    if os.environ.get("BADGE_ALLOW_EPHEMERAL_KEY", "").lower() not in ("1", "true", "yes"):
+        raise RuntimeError("BADGE_SIGNING_KEY is not configured")
+
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    logger.warning("No BADGE_SIGNING_KEY configured, using an ephemeral development key")
+    return ed25519.Ed25519PrivateKey.generate().private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+@functools.cache
+def load_private_key(pem: bytes):
+    from cryptography.hazmat.primitives import serialization
+
+    return serialization.load_pem_private_key(pem, password=None)
+
+
+def get_algorithm(key) -> str:
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return "EdDSA"
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return "RS256"
+    raise ValueError(f"Unsupported badge signing key type: {type(key).__name__}")
+
+
+@functools.cache
+def get_verification_key():
+    """Public half of the signing key, cached for the life of the process."""
+    return load_private_key(get_signing_key_pem()).public_key()
+
+
+@functools.cache
+def get_issuer() -> str:
+    try:
+        return db.secrets.get("BADGE_ISSUER") or DEFAULT_ISSUER
+    except Exception:
+        return DEFAULT_ISSUER
+
+
+def build_claims(
+    badge_id: int,
+    user_id: str,
+    skill_name: str,
+    skill_level: str,
+    issued_at: datetime.datetime,
+) -> dict[str, Any]:
+    issued = int(issued_at.timestamp())
+    return {
+        "iss": get_issuer(),
+        "sub": user_id,
+        "jti": f"urn:skillforge:badge:{badge_id}",
+        "iat": issued,
+        "nbf": issued,
+        "badge_id": badge_id,
+        "vc": {
+            "@context": ["https://www.w3.org/2018/credentials/v1"],
+            "type": ["VerifiableCredential", "SkillBadgeCredential"],
+            "issuanceDate": issued_at.isoformat(),
+            "credentialSubject": {
+                "id": user_id,
+                "skill": {"name": skill_name, "level": skill_level},
+            },
+        },
+    }
+
+
+def _sign_batch(pem: bytes, batch: list[dict[str, Any]]) -> list[str]:
+    # Runs in the executor, the key is parsed once per thread pool / process
+    key = load_private_key(pem)
+    alg = get_algorithm(key)
+    return [jwt.encode(claims, key, algorithm=alg) for claims in batch]
+
+
+class BatchSigner:
+    """Collects signing requests and signs them in batches in an executor."""
+
+    def __init__(self, executor: Executor, max_batch_size: int = MAX_BATCH_SIZE):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self._pending: asyncio.Queue[tuple[dict[str, Any], asyncio.Future]] = asyncio.Queue()
+        self._runner: asyncio.Task | None = None
+
+    async def sign(self, claims: dict[str, Any]) -> str:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._pending.put((claims, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            while len(batch) < self.max_batch_size and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+
+            try:
+                pem = get_signing_key_pem()
+                tokens = await loop.run_in_executor(
+                    self.executor, _sign_batch, pem, [claims for claims, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), token in zip(batch, tokens):
+                if not future.done():
+                    future.set_result(token)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_signer: BatchSigner | None = None
+
+
+def get_signer() -> BatchSigner:
+    global _signer
+    if _signer is None:
+        workers = max(1, min(4, os.cpu_count() or 1))
+        if os.environ.get("BADGE_SIGNING_POOL") == "process":
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="badge-signer")
+        _signer = BatchSigner(executor)
+    return _signer
+
+
+async def close_signer() -> None:
+    global _signer
+    if _signer is not None:
+        await _signer.close()
+        _signer = None
+
+
+async def sign_badge(
+    badge_id: int,
+    user_id: str,
+    skill_name: str,
+    skill_level: str,
+    issued_at: datetime.datetime,
+) -> str:
+    claims = build_claims(badge_id, user_id, skill_name, skill_level, issued_at)
+    return await get_signer().sign(claims)
+
+
+def verify_credential(token: str) -> dict[str, Any]:
+    """Verify signature and issuer of a credential. Raises jwt.PyJWTError if invalid."""
+    key = get_verification_key()
+    return jwt.decode(
+        token,
+        key=key,
+        algorithms=[get_algorithm(key)],
+        issuer=get_issuer(),
+        options={"require": ["iss", "sub", "jti", "iat"]},
+    )
+
+
+class VerificationCache:
+    """Bounded LRU cache of verification results with a time to live."""
+
+    def __init__(self, maxsize: int = 100_000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+verification_cache = VerificationCache()
+
+
+async def requeue_unsigned() -> None:
+    """Queue signing again for unsigned badges whose task failed or never existed."""
+    async with connection(Intent.WRITE) as conn:
+        async with conn.transaction():
+            retried = await conn.execute(
+                """
+                UPDATE background_tasks t
+                SET status = 'pending', attempts = 0, run_at = NOW(), locked_at = NULL, last_error = NULL
+                FROM badges b
+                WHERE t.task_key = $1 || ':' || b.id AND t.status = 'failed' AND b.signed_vc_jwt IS NULL
+                """,
+                SIGN_TASK,
+            )
+            # Same payload and key as the task enqueued by issue_badge
+            queued = await conn.execute(
+                """
+                INSERT INTO background_tasks (queue, name, task_key, payload)
+                SELECT $2, $1, $1 || ':' || b.id, jsonb_build_object('badge_id', b.id, 'assessment_id', b.assessment_id)
+                FROM badges b WHERE b.signed_vc_jwt IS NULL
+                ON CONFLICT (task_key) DO NOTHING
+                """,
+                SIGN_TASK,
+                SIGN_QUEUE,
+            )
+            count = int(retried.rsplit(" ", 1)[-1]) + int(queued.rsplit(" ", 1)[-1])
+            if count:
+                logger.info("Queued %d unsigned badges for signing", count)
+                await conn.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, SIGN_QUEUE)
+
+
+async def _resign_loop() -> None:
+    while True:
+        try:
+            # Only once a key is available, signing would just fail again
+            await asyncio.to_thread(get_signing_key_pem)
+        except RuntimeError:
+            pass
+        else:
+            try:
+                await requeue_unsigned()
+            except Exception as e:
+                logger.warning("Failed to queue unsigned badges: %s", e)
+        await asyncio.sleep(RESIGN_INTERVAL)
+
+
+_resign_task: asyncio.Task | None = None
+
+
+async def start_resign_sweep() -> None:
+    global _resign_task
+    _resign_task = asyncio.create_task(_resign_loop())
+
+
+async def stop_resign_sweep() -> None:
+    global _resign_task
+    if _resign_task is not None:
+        _resign_task.cancel()
+        await asyncio.gather(_resign_task, return_exceptions=True)
+        _resign_task = None
+
+
+async def migrate() -> None:
+    conn = await get_db_connection()
+    try:
+        await conn.execute(MIGRATION)
+    finally:
+        await conn.close()
+
+
+__all__ = [
+    "BatchSigner",
+    "VerificationCache",
+    "build_claims",
+    "close_signer",
+    "get_verification_key",
+    "migrate",
+    "requeue_unsigned",
+    "sign_badge",
+    "start_resign_sweep",
+    "stop_resign_sweep",
+    "verification_cache",
+    "verify_credential",
+]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -1,12 +1,349 @@
-import databutton as db
+"""Connection routing between a primary database and optional read replicas.
+
+Usage:
+
+    from app.libs.database import ReadConnection, WriteConnection
+
+    @router.get("/example-data")
+    async def get_example_data(conn: ReadConnection, user: AuthorizedUser):
+        return await conn.fetch("SELECT ... WHERE user_id = $1", user.sub)
+
+Reads go to a replica unless the same user wrote within the last
+`read_your_writes_window` seconds, or no replica is currently healthy, in
+which case they are served by the primary.
+
+The time of a user's last write travels with the client, so this holds
+across worker processes and instances: requests that take a write
+connection set a `db_last_write` cookie and an X-DB-Last-Write response
+header, and reads honour either one. Clients on another origin, where the
+cookie isn't sent, echo the header back on their next requests.
+
+The primary url is taken from the DATABASE_URL_DEV secret, which the
+routers have always connected with, and replicas from the comma separated
+DATABASE_URL_REPLICAS_PROD/DEV secret. The DATABASE_URL_PRIMARY and
+DATABASE_URL_REPLICAS environment variables take precedence, which makes it
+easy to point the app at local instances (see benchmarks/replica_routing.py).
+Standalone connections from `get_db_connection`, used for listeners and
+migrations, keep using the DATABASE_URL_ADMIN_PROD/DEV secret.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Annotated, AsyncIterator
+
 import asyncpg
-from app.env import mode, Mode
+import databutton as db
+from fastapi import Depends, Request, Response
+from fastapi.responses import JSONResponse
+
+from app.auth import AuthorizedUser
+from app.env import Mode, mode
+from app.libs.db_instrumentation import InstrumentedConnection
+from app.libs.metrics import DB_POOL_ACQUIRE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseUnavailable(Exception):
+    """The database could not be reached. Answered with a 500 by the app."""
+
+
+class Intent(str, Enum):
+    READ = "read"
+    WRITE = "write"
+
+
+# Seconds a replica is skipped after a failed acquire
+REPLICA_COOLDOWN = 30.0
+
+# Seconds given to in-flight queries when an unhealthy replica pool is closed
+REPLICA_CLOSE_TIMEOUT = 60.0
+
+LAST_WRITE_COOKIE = "db_last_write"
+LAST_WRITE_HEADER = "x-db-last-write"
+
+
+def _get_secret(name: str) -> str | None:
+    try:
+        return db.secrets.get(name) or None
+    except Exception:
+        return None
+
+
+def get_primary_url() -> str:
+    url = os.environ.get("DATABASE_URL_PRIMARY") or _get_secret("DATABASE_URL_DEV")
+    if url is None:
+        raise RuntimeError("No database configured, set the DATABASE_URL_DEV secret or DATABASE_URL_PRIMARY")
+    return url
+
+
+def get_admin_url() -> str:
+    name = "DATABASE_URL_ADMIN_PROD" if mode == Mode.PROD else "DATABASE_URL_ADMIN_DEV"
+    url = os.environ.get("DATABASE_URL_PRIMARY") or _get_secret(name)
+    if url is None:
+        raise RuntimeError(f"No database configured, set the {name} secret or DATABASE_URL_PRIMARY")
+    return url
+
+
+def get_replica_urls() -> list[str]:
+    urls = os.environ.get("DATABASE_URL_REPLICAS")
+    if urls is None:
+        if mode == Mode.PROD:
+            urls = _get_secret("DATABASE_URL_REPLICAS_PROD")
+        else:
+            urls = _get_secret("DATABASE_URL_REPLICAS_DEV")
+    return [u.strip() for u in (urls or "").split(",") if u.strip()]
+
+
+class ConnectionRouter:
+    """Owns the primary and replica pools and decides where a query goes."""
+
+    def __init__(
+        self,
+        primary_url: str,
+        replica_urls: list[str] | None = None,
+        read_your_writes_window: float = 5.0,
+        min_size: int = 1,
+        max_size: int = 10,
+    ):
+        self.primary_url = primary_url
+        self.replica_urls = list(replica_urls or [])
+        self.read_your_writes_window = read_your_writes_window
+        self.min_size = min_size
+        self.max_size = max_size
+
+        self._primary: asyncpg.Pool | None = None
+        self._replicas: dict[str, asyncpg.Pool] = {}
+        # Concurrent first callers must not each create, and leak, a pool
+        self._pool_locks: dict[str, asyncio.Lock] = {}
+        self._unhealthy_until: dict[str, float] = {}
+        self._replica_cycle = itertools.cycle(self.replica_urls)
+        self._last_write: dict[str, float] = {}
+        self._closing: set[asyncio.Task] = set()
+
+    async def _create_pool(self, url: str) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            url,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            connection_class=InstrumentedConnection,
+        )
+
+    def _pool_lock(self, url: str) -> asyncio.Lock:
+        return self._pool_locks.setdefault(url, asyncio.Lock())
+
+    async def primary_pool(self) -> asyncpg.Pool:
+        if self._primary is None:
+            async with self._pool_lock(self.primary_url):
+                if self._primary is None:
+                    self._primary = await self._create_pool(self.primary_url)
+        return self._primary
+
+    async def replica_pool(self, url: str) -> asyncpg.Pool:
+        pool = self._replicas.get(url)
+        if pool is None:
+            async with self._pool_lock(url):
+                pool = self._replicas.get(url)
+                if pool is None:
+                    pool = await self._create_pool(url)
+                    self._replicas[url] = pool
+        return pool
+
+    def note_write(self, user_id: str | None) -> None:
+        if user_id is None:
+            return
+        now = time.monotonic()
+        self._last_write[user_id] = now
+
+        # Keep the map from growing without bound
+        if len(self._last_write) > 10_000:
+            cutoff = now - self.read_your_writes_window
+            self._last_write = {
+                k: v for k, v in self._last_write.items() if v >= cutoff
+            }
+
+    def wrote_recently(self, user_id: str | None, last_write: float | None = None) -> bool:
+        """Whether the user wrote within the window.
+
+        `last_write` is the wall clock time of the last write as reported by
+        the client, which covers writes made through other processes. It is
+        untrusted, so values outside the window, including ones far in the
+        future, are ignored rather than pinning the client to the primary.
+        """
+        if last_write is not None:
+            now = time.time()
+            if abs(now - last_write) < self.read_your_writes_window:
+                return True
+        if user_id is None:
+            return False
+        last = self._last_write.get(user_id)
+        if last is None:
+            return False
+        return time.monotonic() - last < self.read_your_writes_window
+
+    def _healthy_replicas(self) -> list[str]:
+        now = time.monotonic()
+        healthy = []
+        for _ in range(len(self.replica_urls)):
+            url = next(self._replica_cycle)
+            if self._unhealthy_until.get(url, 0.0) <= now:
+                healthy.append(url)
+        return healthy
+
+    def _mark_unhealthy(self, url: str) -> None:
+        self._unhealthy_until[url] = time.monotonic() + REPLICA_COOLDOWN
+        pool = self._replicas.pop(url, None)
+        if pool is not None:
+            # Let queries already running on the pool finish
+            task = asyncio.create_task(self._close_pool(pool))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _close_pool(self, pool: asyncpg.Pool) -> None:
+        try:
+            await asyncio.wait_for(pool.close(), REPLICA_CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.warning("Replica pool did not close cleanly: %s", e)
+            pool.terminate()
+
+    @asynccontextmanager
+    async def acquire(
+        self, intent: Intent, user_id: str | None = None, last_write: float | None = None
+    ) -> AsyncIterator[asyncpg.Connection]:
+        if intent == Intent.READ and not self.wrote_recently(user_id, last_write):
+            for url in self._healthy_replicas():
+                try:
+                    pool = await self.replica_pool(url)
+                    with DB_POOL_ACQUIRE_SECONDS.labels("replica").time():
+                        conn = await pool.acquire()
+                except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    logger.warning("Replica unavailable, trying next: %s", e)
+                    self._mark_unhealthy(url)
+                    continue
+                try:
+                    yield conn
+                finally:
+                    await pool.release(conn)
+                return
+
+        pool = await self.primary_pool()
+        with DB_POOL_ACQUIRE_SECONDS.labels("primary").time():
+            conn = await pool.acquire()
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+        if intent == Intent.WRITE:
+            self.note_write(user_id)
+
+    async def close(self) -> None:
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        pools = list(self._replicas.values())
+        if self._primary is not None:
+            pools.append(self._primary)
+        for pool in pools:
+            await pool.close()
+        self._primary = None
+        self._replicas.clear()
+
+
+_router: ConnectionRouter | None = None
+
+
+def configure(
+    primary_url: str | None = None,
+    replica_urls: list[str] | None = None,
+    **kwargs,
+) -> ConnectionRouter:
+    """Replace the process wide router, e.g. to point at local instances."""
+    global _router
+    _router = ConnectionRouter(
+        primary_url or get_primary_url(),
+        get_replica_urls() if replica_urls is None else replica_urls,
+        **kwargs,
+    )
+    return _router
+
+
+def get_router() -> ConnectionRouter:
+    if _router is None:
+        return configure()
+    return _router
+
+
+async def close_pools() -> None:
+    if _router is not None:
+        await _router.close()
+
 
 async def get_db_connection():
-    if mode == Mode.PROD:
-        db_url = db.secrets.get("DATABASE_URL_ADMIN_PROD")
-    else:
-        db_url = db.secrets.get("DATABASE_URL_ADMIN_DEV")
-    
-    conn = await asyncpg.connect(db_url)
+    """Open a standalone connection to the primary with the admin credentials."""
+    conn = await asyncpg.connect(get_admin_url())
     return conn
+
+
+@asynccontextmanager
+async def connection(
+    intent: Intent, user_id: str | None = None, last_write: float | None = None
+) -> AsyncIterator[asyncpg.Connection]:
+    try:
+        async with get_router().acquire(intent, user_id, last_write) as conn:
+            yield conn
+    except (OSError, asyncpg.InterfaceError) as e:
+        logger.error("Database connection error: %s", e)
+        raise DatabaseUnavailable(str(e)) from e
+
+
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable) -> JSONResponse:
+    return JSONResponse({"detail": "Could not connect to the database."}, status_code=500)
+
+
+def get_client_last_write(request: Request) -> float | None:
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+async def get_read_connection(
+    user: AuthorizedUser, request: Request
+) -> AsyncIterator[asyncpg.Connection]:
+    async with connection(Intent.READ, user.sub, get_client_last_write(request)) as conn:
+        yield conn
+
+
+async def get_write_connection(
+    user: AuthorizedUser, response: Response
+) -> AsyncIterator[asyncpg.Connection]:
+    # Set before the handler runs, headers added after it returns are lost
+    now = f"{time.time():.3f}"
+    window = int(get_router().read_your_writes_window) + 1
+    response.headers[LAST_WRITE_HEADER] = now
+    response.set_cookie(LAST_WRITE_COOKIE, now, max_age=window, httponly=True, samesite="lax")
+    async with connection(Intent.WRITE, user.sub) as conn:
+        yield conn
+
+
+ReadConnection = Annotated[asyncpg.Connection, Depends(get_read_connection)]
+WriteConnection = Annotated[asyncpg.Connection, Depends(get_write_connection)]
+
+__all__ = [
+    "ConnectionRouter",
+    "DatabaseUnavailable",
+    "Intent",
+    "ReadConnection",
+    "WriteConnection",
+    "close_pools",
+    "configure",
+    "connection",
+    "database_unavailable_handler",
+    "get_db_connection",
+    "get_router",
+]
@@ -0,0 +1,203 @@
+"""Per-query database instrumentation.
+
+Every statement run through a pooled connection is timed and its row count
+recorded. Statements are grouped by a normalized template, with whitespace
+collapsed and literals replaced by `?`.
+
+- Statements slower than DB_SLOW_QUERY_MS (default 200) are logged.
+- `QueryStatsMiddleware` collects the statements of each request, with the
+  count, total duration and rows of every template, logs them at DEBUG
+  level and logs a possible N+1 pattern when one template runs more than
+  DB_N_PLUS_ONE_THRESHOLD (default 5) times.
+- With DB_QUERY_STATS_HEADERS=true it also adds X-DB-Query-Count and
+  X-DB-Query-Time-Ms headers to every response. Meant for local
+  development only, they expose internals.
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+
+import asyncpg
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.libs.metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_SECONDS = float(os.environ.get("DB_SLOW_QUERY_MS", "200")) / 1000
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("DB_N_PLUS_ONE_THRESHOLD", "5"))
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(query: str) -> str:
+    query = _STRING_LITERAL.sub("?", query)
+    query = _NUMBER_LITERAL.sub("?", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+@dataclass
+class TemplateStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    rows: int = 0
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    templates: dict[str, TemplateStats] = field(default_factory=dict)
+
+    def add(self, template: str, seconds: float, rows: int) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        stats = self.templates.get(template)
+        if stats is None:
+            stats = self.templates[template] = TemplateStats()
+        stats.count += 1
+        stats.total_seconds += seconds
+        stats.rows += rows
+
+    def summary(self) -> list[dict]:
+        """Templates with their count, duration and rows, slowest first."""
+        return [
+            {
+                "query": template,
+                "count": stats.count,
+                "duration_ms": round(stats.total_seconds * 1000, 2),
+                "rows": stats.rows,
+            }
+            for template, stats in sorted(self.templates.items(), key=lambda item: -item[1].total_seconds)
+        ]
+
+
+query_stats: contextvars.ContextVar[QueryStats | None] = contextvars.ContextVar(
+    "query_stats", default=None
+)
+
+
+def record(operation: str, query: str, seconds: float, rows: int) -> None:
+    DB_QUERY_SECONDS.labels(operation).observe(seconds)
+    template = normalize(query)
+
+    stats = query_stats.get()
+    if stats is not None:
+        stats.add(template, seconds, rows)
+
+    if seconds >= SLOW_QUERY_SECONDS:
+        logger.warning(
+            "Slow query",
+            extra={
+                "query": template,
+                "operation": operation,
+                "duration_ms": round(seconds * 1000, 2),
+                "rows": rows,
+            },
+        )
+
+
+def rows_from_status(status: str) -> int:
+    # e.g. "UPDATE 3", "INSERT 0 1", "SELECT 5"
+    last = status.rsplit(" ", 1)[-1]
+    return int(last) if last.isdigit() else 0
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    """Connection that records duration and row count of every statement."""
+
+    async def execute(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        status = await super().execute(query, *args, **kwargs)
+        record("execute", query, time.perf_counter() - started, rows_from_status(status))
+        return status
+
+    async def executemany(self, command, args, **kwargs):
+        # Any iterable is accepted, materialize it so the rows can be counted
+        args = list(args)
+        started = time.perf_counter()
+        result = await super().executemany(command, args, **kwargs)
+        record("executemany", command, time.perf_counter() - started, len(args))
+        return result
+
+    async def fetch(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        result = await super().fetch(query, *args, **kwargs)
+        record("fetch", query, time.perf_counter() - started, len(result))
+        return result
+
+    async def fetchrow(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        result = await super().fetchrow(query, *args, **kwargs)
+        record("fetchrow", query, time.perf_counter() - started, 0 if result is None else 1)
+        return result
+
+    async def fetchval(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        result = await super().fetchval(query, *args, **kwargs)
+        record("fetchval", query, time.perf_counter() - started, 0 if result is None else 1)
+        return result
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.add_headers = os.environ.get("DB_QUERY_STATS_HEADERS", "false").lower() in ("1", "true", "yes")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+
+        async def send_wrapper(message: Message) -> None:
+            if self.add_headers and message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-db-query-count", str(stats.count).encode()),
+                    (b"x-db-query-time-ms", f"{stats.total_seconds * 1000:.2f}".encode()),
+                ]
+            await send(message)
+
+        token = query_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            query_stats.reset(token)
+            if stats.count and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Request queries",
+                    extra={"method": scope["method"], "path": scope["path"], "queries": stats.summary()},
+                )
+            for template, template_stats in stats.templates.items():
+                if template_stats.count > N_PLUS_ONE_THRESHOLD:
+                    logger.warning(
+                        "Possible N+1 query",
+                        extra={
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "query": template,
+                            "count": template_stats.count,
+                            "duration_ms": round(template_stats.total_seconds * 1000, 2),
+                            "rows": template_stats.rows,
+                        },
+                    )
+
+
+__all__ = [
+    "InstrumentedConnection",
+    "QueryStats",
+    "QueryStatsMiddleware",
+    "TemplateStats",
+    "normalize",
+    "query_stats",
+]
@@ -0,0 +1,466 @@
+"""Idempotency-Key support for POST requests.
+
+A client that may retry a POST sends the same `Idempotency-Key` header with
+every attempt:
+
+    POST /routes/assessments
+    Idempotency-Key: 6f1c0b8e-...
+
+The first attempt runs normally and its response (status, headers and body)
+is stored for IDEMPOTENCY_TTL_SECONDS (default 24 hours). Retries get the
+stored response back, marked with an `Idempotent-Replayed: true` header,
+without running the handler again. A retry that arrives while the first
+attempt is still running waits for it to finish.
+
+Keys are scoped to the verified user (the token's `sub`), method and path,
+so they can't collide between users and survive token refreshes. Requests
+whose token doesn't verify are passed through untouched and get their 401
+from the route. Reusing a key with a different request body is
+refused with 422. Server errors and transient refusals (401, 408, 429) are
+not stored, so those requests can be retried for real.
+
+Stores, selected with IDEMPOTENCY_STORE:
+
+- memory (default): bounded LRU per worker process, IDEMPOTENCY_MAX_ENTRIES
+  (default 10000). Retries that land on another worker run again.
+- postgres: the idempotency_keys table, shared by all workers.
+- redis: IDEMPOTENCY_REDIS_URL, shared by all workers.
+
+If the store fails, the request is handled as if it carried no key.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.libs.database import Intent, connection
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+
+MAX_KEY_LENGTH = 255
+
+# Statuses worth retrying for real, never stored
+TRANSIENT_STATUSES = frozenset({401, 408, 429})
+
+# An in-flight reservation older than this is assumed abandoned
+LOCK_TIMEOUT_SECONDS = 60.0
+
+# How long a duplicate waits for another worker's attempt before giving up
+WAIT_TIMEOUT_SECONDS = 30.0
+POLL_INTERVAL_SECONDS = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status INT,
+    headers JSONB,
+    body BYTEA,
+    locked_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx ON idempotency_keys (expires_at);
+"""
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers],
+            "body": base64.b64encode(self.body).decode(),
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> "StoredResponse":
+        entry = json.loads(data)
+        return cls(
+            fingerprint=entry["fingerprint"],
+            status=entry["status"],
+            headers=[(k.encode("latin-1"), v.encode("latin-1")) for k, v in entry["headers"]],
+            body=base64.b64decode(entry["body"]),
+        )
+
+
+class Pending:
+    """Another attempt with the same key is in flight."""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+
+
+# reserve() returns None when the caller now owns the key
+Reservation = StoredResponse | Pending | None
+
+
+class MemoryStore:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires at, fingerprint, response or None while in flight)
+        self._entries: OrderedDict[str, tuple[float, str, StoredResponse | None]] = OrderedDict()
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[2] if entry[2] is not None else Pending(entry[1])
+
+        self._entries[key] = (now + LOCK_TIMEOUT_SECONDS, fingerprint, None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return None
+
+    async def get(self, key: str) -> Reservation:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[2] if entry[2] is not None else Pending(entry[1])
+
+    async def complete(self, key: str, response: StoredResponse) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, response.fingerprint, response)
+
+    async def release(self, key: str) -> None:
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] is None:
+            del self._entries[key]
+
+
+class PostgresStore:
+    # Expired rows are deleted at most this often
+    PURGE_INTERVAL = 300.0
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._schema_ready = False
+        self._last_purge = 0.0
+
+    async def _ensure_schema(self, conn) -> None:
+        if not self._schema_ready:
+            await conn.execute(SCHEMA)
+            self._schema_ready = True
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation:
+        async with connection(Intent.WRITE) as conn:
+            await self._ensure_schema(conn)
+            await self._maybe_purge(conn)
+            reserved = await conn.fetchval(
+                """
+                INSERT INTO idempotency_keys (key, fingerprint, expires_at)
+                VALUES ($1, $2, NOW() + make_interval(secs => $3))
+                ON CONFLICT (key) DO UPDATE SET
+                    fingerprint = EXCLUDED.fingerprint, status = NULL, headers = NULL, body = NULL,
+                    locked_at = NOW(), expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at < NOW()
+                   OR (idempotency_keys.status IS NULL
+                       AND idempotency_keys.locked_at < NOW() - make_interval(secs => $4))
+                RETURNING key
+                """,
+                key,
+                fingerprint,
+                self.ttl,
+                LOCK_TIMEOUT_SECONDS,
+            )
+            if reserved:
+                return None
+            return await self._load(conn, key)
+
+    async def get(self, key: str) -> Reservation:
+        async with connection(Intent.WRITE) as conn:
+            return await self._load(conn, key)
+
+    async def _load(self, conn, key: str) -> Reservation:
+        row = await conn.fetchrow(
+            "SELECT fingerprint, status, headers, body FROM idempotency_keys WHERE key = $1 AND expires_at > NOW()",
+            key,
+        )
+        if row is None:
+            return None
+        if row['status'] is None:
+            return Pending(row['fingerprint'])
+        return StoredResponse(
+            fingerprint=row['fingerprint'],
+            status=row['status'],
+            headers=[(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(row['headers'])],
+            body=row['body'],
+        )
+
+    async def complete(self, key: str, response: StoredResponse) -> None:
+        headers = json.dumps([[k.decode("latin-1"), v.decode("latin-1")] for k, v in response.headers])
+        async with connection(Intent.WRITE) as conn:
+            await conn.execute(
+                "UPDATE idempotency_keys SET status = $2, headers = $3, body = $4 WHERE key = $1",
+                key,
+                response.status,
+                headers,
+                response.body,
+            )
+
+    async def release(self, key: str) -> None:
+        async with connection(Intent.WRITE) as conn:
+            await conn.execute("DELETE FROM idempotency_keys WHERE key = $1 AND status IS NULL", key)
+
+    async def _maybe_purge(self, conn) -> None:
+        now = time.monotonic()
+        if now - self._last_purge < self.PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        await conn.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW()")
+
+
+class RedisStore:
+    def __init__(self, url: str, ttl: float):
+        # Imported here as redis is only needed for this store
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"idempotency:{key}"
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation:
+        pending = json.dumps({"fingerprint": fingerprint, "pending": True})
+        if await self._client.set(self._key(key), pending, nx=True, ex=int(LOCK_TIMEOUT_SECONDS)):
+            return None
+        return await self.get(key)
+
+    async def get(self, key: str) -> Reservation:
+        data = await self._client.get(self._key(key))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        if entry.get("pending"):
+            return Pending(entry["fingerprint"])
+        return StoredResponse.from_json(data)
+
+    async def complete(self, key: str, response: StoredResponse) -> None:
+        await self._client.set(self._key(key), response.to_json(), ex=int(self.ttl))
+
+    async def release(self, key: str) -> None:
+        await self._client.delete(self._key(key))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_store() -> MemoryStore | PostgresStore | RedisStore:
+    ttl = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    kind = os.environ.get("IDEMPOTENCY_STORE", "memory").lower()
+    if kind == "postgres":
+        return PostgresStore(ttl)
+    if kind == "redis":
+        return RedisStore(os.environ["IDEMPOTENCY_REDIS_URL"], ttl)
+    return MemoryStore(ttl, int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000")))
+
+
+async def read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def buffered_receive(body: bytes, receive: Receive) -> Receive:
+    """Hand the already read body to the app once, then defer to `receive`."""
+    sent = False
+
+    async def replay_receive() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Waits for http.disconnect like the real one
+        return await receive()
+
+    return replay_receive
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.store = create_store()
+        # Attempts running in this process, duplicates wait on these
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = None
+        authorized = False
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER:
+                idempotency_key = value
+            elif name == b"authorization":
+                authorized = True
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = JSONResponse({"detail": "Invalid Idempotency-Key header."}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        user_id = await self._user_id(scope) if authorized else ""
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = hashlib.sha256(
+            b"\n".join([user_id.encode(), scope["method"].encode(), scope["path"].encode(), idempotency_key])
+        ).hexdigest()
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        replay_receive = buffered_receive(body, receive)
+
+        while True:
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                # Same process, wait for the first attempt to finish
+                await asyncio.shield(in_flight)
+                continue
+
+            try:
+                reservation = await self.store.reserve(key, fingerprint)
+            except Exception as e:
+                logger.warning("Idempotency store unavailable, handling request normally: %s", e)
+                await self.app(scope, replay_receive, send)
+                return
+
+            if reservation is None:
+                await self._execute(key, fingerprint, scope, replay_receive, send)
+                return
+
+            if reservation.fingerprint != fingerprint:
+                response = JSONResponse(
+                    {"detail": "Idempotency-Key was already used with a different request body."},
+                    status_code=422,
+                )
+                await response(scope, receive, send)
+                return
+
+            if isinstance(reservation, StoredResponse):
+                await self._replay(reservation, send)
+                return
+
+            # Another worker is handling it, wait for its response
+            stored = await self._wait(key)
+            if isinstance(stored, StoredResponse):
+                await self._replay(stored, send)
+                return
+            if isinstance(stored, Pending):
+                response = JSONResponse(
+                    {"detail": "A request with this Idempotency-Key is still in progress."},
+                    status_code=409,
+                )
+                await response(scope, receive, send)
+                return
+            # The other attempt was not stored, try to run it here
+
+    async def _user_id(self, scope: Scope) -> str | None:
+        """The verified `sub` of the request's token, None if it doesn't verify."""
+        from databutton_app.mw.auth_mw import authorize_request
+
+        auth_config = scope["app"].state.auth_config
+        if auth_config is None:
+            return None
+        try:
+            user = await asyncio.to_thread(authorize_request, Request(scope), auth_config)
+        except Exception:
+            return None
+        return user.sub if user is not None else None
+
+    async def _execute(self, key: str, fingerprint: str, scope: Scope, receive: Receive, send: Send) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        status = 500
+        headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            try:
+                if status < 500 and status not in TRANSIENT_STATUSES:
+                    await self.store.complete(
+                        key, StoredResponse(fingerprint, status, headers, b"".join(chunks))
+                    )
+                else:
+                    await self.store.release(key)
+            except Exception as e:
+                logger.warning("Failed to store idempotent response: %s", e)
+            finally:
+                del self._in_flight[key]
+                future.set_result(None)
+
+    async def _wait(self, key: str) -> Reservation:
+        deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+        reservation: Reservation = None
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            try:
+                reservation = await self.store.get(key)
+            except Exception as e:
+                logger.warning("Idempotency store unavailable: %s", e)
+                return None
+            if not isinstance(reservation, Pending):
+                return reservation
+        return reservation
+
+    async def _replay(self, stored: StoredResponse, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": stored.status,
+            "headers": [*stored.headers, REPLAYED_HEADER],
+        })
+        await send({"type": "http.response.body", "body": stored.body})
+
+
+__all__ = [
+    "IdempotencyMiddleware",
+    "MemoryStore",
+    "PostgresStore",
+    "RedisStore",
+    "StoredResponse",
+]
@@ -0,0 +1,125 @@
+"""Full-text and trigram indexes backing the job search endpoint.
+
+The jobs table gets a `search_vector` column, weighting the title above the
+description, with a GIN index for full-text matches, plus a pg_trgm GIN
+index on the title for typo tolerant matches.
+
+This is a one-off migration, run once per database by someone allowed to
+create extensions:
+
+    python -m app.libs.job_search
+
+It avoids long locks on jobs: the column is added without a table rewrite,
+kept up to date by a trigger, backfilled in small batches and indexed
+CONCURRENTLY. It is safe to run again, e.g. after an interrupted run.
+
+The app itself only checks on startup that the migration was applied, and
+the search endpoint answers 503 until it is.
+"""
+
+import asyncio
+import logging
+
+import asyncpg
+
+from app.libs.database import Intent, connection, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Same expression as the trigger below, for the backfill
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+"""
+
+MIGRATION = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION jobs_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS jobs_search_vector_trigger ON jobs",
+    """
+    CREATE TRIGGER jobs_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON jobs
+    FOR EACH ROW EXECUTE FUNCTION jobs_search_vector_update()
+    """,
+]
+
+INDEXES = {
+    "jobs_search_vector_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_search_vector_idx ON jobs USING GIN (search_vector)",
+    "jobs_title_trgm_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_title_trgm_idx ON jobs USING GIN (title gin_trgm_ops)",
+}
+
+# Errors raised by search queries while the migration hasn't been applied
+SCHEMA_MISSING_ERRORS = (asyncpg.UndefinedColumnError, asyncpg.UndefinedFunctionError)
+
+
+async def migrate() -> None:
+    # A standalone connection, CREATE INDEX CONCURRENTLY can't run in a transaction
+    conn = await get_db_connection()
+    try:
+        for statement in MIGRATION:
+            await conn.execute(statement)
+
+        while True:
+            status = await conn.execute(
+                f"""
+                UPDATE jobs SET search_vector = {SEARCH_VECTOR}
+                WHERE id IN (SELECT id FROM jobs WHERE search_vector IS NULL LIMIT $1)
+                """,
+                BACKFILL_BATCH_SIZE,
+            )
+            updated = int(status.rsplit(" ", 1)[-1])
+            logger.info("Backfilled search vectors of %d jobs", updated)
+            if updated < BACKFILL_BATCH_SIZE:
+                break
+
+        for name, statement in INDEXES.items():
+            # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index
+            # behind, which IF NOT EXISTS would keep
+            invalid = await conn.fetchval(
+                "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name
+            )
+            if invalid:
+                logger.info("Rebuilding invalid index %s", name)
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def check_search_schema() -> None:
+    """Warn on startup when the migration hasn't been applied."""
+    try:
+        async with connection(Intent.READ) as conn:
+            ready = await conn.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'jobs' AND column_name = 'search_vector'
+                ) AND EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')
+                """
+            )
+    except Exception as e:
+        logger.warning("Could not check the job search schema: %s", e)
+        return
+    if not ready:
+        logger.warning("Job search is unavailable, run `python -m app.libs.job_search` to migrate")
+
+
+__all__ = ["SCHEMA_MISSING_ERRORS", "check_search_schema", "migrate"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -0,0 +1,52 @@
+"""Prometheus metrics for the database, background tasks and upstream AI calls.
+
+Usage:
+
+    from app.libs.metrics import AI_UPSTREAM_SECONDS
+
+    with AI_UPSTREAM_SECONDS.labels("ok").time():
+        ...
+
+HTTP and authentication metrics live next to their middleware in
+mw/metrics_mw.py. All of them are served by the /metrics endpoint.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a pooled database connection",
+    ["pool"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing database statements",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+TASK_QUEUE_DEPTH = Gauge(
+    "task_queue_depth",
+    "Background tasks waiting to run",
+    ["queue"],
+    multiprocess_mode="max",
+)
+AI_UPSTREAM_SECONDS = Histogram(
+    "ai_upstream_duration_seconds",
+    "Latency of calls to the upstream AI service",
+    ["outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0),
+)
+AI_UPSTREAM_ERRORS = Counter(
+    "ai_upstream_errors_total",
+    "Failed calls to the upstream AI service",
+    ["error"],
+)
+
+__all__ = [
+    "AI_UPSTREAM_ERRORS",
+    "AI_UPSTREAM_SECONDS",
+    "DB_POOL_ACQUIRE_SECONDS",
+    "DB_QUERY_SECONDS",
+    "TASK_QUEUE_DEPTH",
+]
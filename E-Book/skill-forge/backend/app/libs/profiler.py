@@ -0,0 +1,245 @@
+"""On-demand sampling profiler for live requests.
+
+Enable with PROFILER_ENABLED=true. A request is profiled when either
+
+- it carries an `X-Profile: 1` header and a bearer token of a user listed in
+  PROFILER_ADMIN_USERS (comma separated user ids), or
+- it is picked at random with probability PROFILER_SAMPLE_RATE (default 0).
+
+A background thread samples the stack of every profiled request each
+PROFILER_INTERVAL_MS (default 5) milliseconds. Samples are attributed per
+asyncio task, so concurrent requests never pollute each other's profile:
+while a task runs, its live stack is taken from the event loop thread;
+while it is suspended, its chain of awaiting coroutines is recorded instead,
+so the profile shows wall-clock time including time spent waiting.
+
+Finished profiles are kept in a bounded ring buffer (PROFILER_BUFFER_SIZE,
+default 50) and rendered in the collapsed stack format understood by
+flamegraph.pl, speedscope and inferno.
+
+When disabled, the middleware is not installed and the sampler thread never
+starts, so there is no cost at all.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+AWAITING = "<awaiting>"
+
+
+def is_enabled() -> bool:
+    return os.environ.get("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def get_admin_users() -> set[str]:
+    return {u.strip() for u in os.environ.get("PROFILER_ADMIN_USERS", "").split(",") if u.strip()}
+
+
+@dataclass
+class Profile:
+    id: int
+    method: str
+    path: str
+    started_at: float
+    task: asyncio.Task
+    thread_id: int
+    duration_ms: float = 0.0
+    samples: Counter = field(default_factory=Counter)
+
+    def collapsed(self) -> str:
+        """Samples in collapsed stack format, one `frame;frame;frame count` per line."""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "samples": sum(self.samples.values()),
+        }
+
+
+def describe(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def awaiting_stack(coro) -> list[str]:
+    """Frames of a suspended coroutine and everything it is awaiting, outermost first."""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(describe(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    stack.append(AWAITING)
+    return stack
+
+
+def running_stack(thread_frame, outer_frame) -> list[str] | None:
+    """Frames of the event loop thread, from the task's outermost coroutine down.
+
+    None if `outer_frame` isn't on the thread's stack, i.e. the loop switched
+    to another task since the frames were captured.
+    """
+    stack = []
+    frame = thread_frame
+    while frame is not None:
+        stack.append(describe(frame))
+        if frame is outer_frame:
+            stack.reverse()
+            return stack
+        frame = frame.f_back
+    return None
+
+
+class Sampler:
+    """Background thread sampling the stacks of all active profiles."""
+
+    def __init__(self, interval: float, buffer_size: int):
+        self.interval = interval
+        self.finished: deque[Profile] = deque(maxlen=buffer_size)
+        self._active: dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ids = itertools.count(1)
+        self._thread: threading.Thread | None = None
+
+    def start_profile(self, method: str, path: str) -> Profile:
+        profile = Profile(
+            id=next(self._ids),
+            method=method,
+            path=path,
+            started_at=time.time(),
+            task=asyncio.current_task(),
+            thread_id=threading.get_ident(),
+        )
+        with self._lock:
+            self._active[profile.id] = profile
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+        return profile
+
+    def finish_profile(self, profile: Profile, duration_ms: float) -> None:
+        with self._lock:
+            self._active.pop(profile.id, None)
+        profile.duration_ms = duration_ms
+        profile.task = None
+        self.finished.append(profile)
+
+    def get(self, profile_id: int) -> Profile | None:
+        for profile in list(self.finished):
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def _run(self) -> None:
+        while True:
+            # Clear before checking, so a profile started in between sets it again
+            self._wakeup.clear()
+            with self._lock:
+                idle = not self._active
+            if idle:
+                self._wakeup.wait()
+                continue
+
+            thread_frames = sys._current_frames()
+            # Sample under the lock so finished profiles are never mutated
+            with self._lock:
+                for profile in self._active.values():
+                    coro = profile.task.get_coro()
+                    stack = None
+                    if getattr(coro, "cr_running", False):
+                        frame = thread_frames.get(profile.thread_id)
+                        stack = running_stack(frame, coro.cr_frame)
+                    if stack is None:
+                        stack = awaiting_stack(coro)
+                    profile.samples[tuple(stack)] += 1
+            del thread_frames
+            time.sleep(self.interval)
+
+
+_sampler: Sampler | None = None
+
+
+def get_sampler() -> Sampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = Sampler(
+            interval=float(os.environ.get("PROFILER_INTERVAL_MS", "5")) / 1000,
+            buffer_size=int(os.environ.get("PROFILER_BUFFER_SIZE", "50")),
+        )
+    return _sampler
+
+
+class ProfilerMiddleware:
+    """Profiles requests picked by header or by sampling. Only installed when enabled."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.sample_rate = float(os.environ.get("PROFILER_SAMPLE_RATE", "0"))
+        self.admin_users = get_admin_users()
+
+    async def _requested_by_admin(self, scope: Scope) -> bool:
+        if not any(name == PROFILE_HEADER and value == b"1" for name, value in scope["headers"]):
+            return False
+
+        from databutton_app.mw.auth_mw import authorize_request
+
+        auth_config = scope["app"].state.auth_config
+        if auth_config is None:
+            return False
+        try:
+            user = await asyncio.to_thread(authorize_request, Request(scope), auth_config)
+        except Exception:
+            return False
+        return user is not None and user.sub in self.admin_users
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and not await self._requested_by_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = get_sampler()
+        profile = sampler.start_profile(scope["method"], scope["path"])
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.finish_profile(profile, (time.perf_counter() - started) * 1000)
+            logger.info("Request profiled", extra={"profile_id": profile.id, "path": profile.path})
+
+
+__all__ = [
+    "Profile",
+    "ProfilerMiddleware",
+    "Sampler",
+    "get_admin_users",
+    "get_sampler",
+    "is_enabled",
+]
@@ -0,0 +1,190 @@
+"""Token bucket admission control per user and route.
+
+Limits are configured per router in routers.json, for example
+
+    "ai": {"name": "ai", ..., "rateLimit": {"rate": 10, "per": 60, "burst": 5}}
+
+allows each user 10 requests per minute to every route of the router, with
+bursts of up to 5. Buckets are keyed on the authenticated user's `sub` (the
+client address for routers with auth disabled) and the route template.
+Requests over the limit get a 429 response with a Retry-After header.
+
+By default each worker process keeps its own buckets in memory, so with N
+workers a user can get up to N times the configured rate. Set
+RATE_LIMIT_REDIS_URL to share buckets between all workers through Redis,
+where every check is a single atomic script call. If Redis is unreachable
+requests are let through rather than failing.
+
+Set RATE_LIMITS_ENABLED=false to turn limiting off, e.g. for load tests.
+"""
+
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from fastapi import HTTPException, Request
+
+from app.auth import AuthorizedUser
+
+logger = logging.getLogger(__name__)
+
+# In-memory buckets kept before idle, refilled ones are dropped
+MAX_BUCKETS = 100_000
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    # Tokens added per second
+    rate: float
+    # Bucket capacity
+    burst: int
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RateLimit":
+        rate = config["rate"] / config.get("per", 1)
+        return cls(rate=rate, burst=int(config.get("burst", max(1, math.ceil(rate)))))
+
+
+class MemoryBuckets:
+    def __init__(self):
+        # key -> [tokens, last refill time, seconds to refill completely]
+        self._buckets: dict[str, list[float]] = {}
+
+    def take(self, key: str, limit: RateLimit) -> float:
+        """Takes a token, returns 0 if allowed or else the seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._evict(now)
+            self._buckets[key] = [limit.burst - 1, now, limit.burst / limit.rate]
+            return 0.0
+
+        tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / limit.rate
+
+    def _evict(self, now: float) -> None:
+        # A bucket idle long enough to refill completely is the same as no bucket
+        self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < b[2]}
+        if len(self._buckets) >= MAX_BUCKETS:
+            self._buckets.clear()
+
+
+class RedisBuckets:
+    def __init__(self, url: str):
+        # Imported here as redis is only needed in shared mode
+        import redis.asyncio as redis
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        try:
+            retry_after = await self._script(keys=[f"ratelimit:{key}"], args=[limit.rate, limit.burst])
+        except Exception as e:
+            logger.warning("Rate limit check failed, allowing request: %s", e)
+            return 0.0
+        return float(retry_after)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def is_enabled() -> bool:
+    return os.environ.get("RATE_LIMITS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+_memory = MemoryBuckets()
+_redis: RedisBuckets | None = None
+
+
+def get_redis_buckets() -> RedisBuckets | None:
+    global _redis
+    if _redis is None and (url := os.environ.get("RATE_LIMIT_REDIS_URL")):
+        _redis = RedisBuckets(url)
+    return _redis
+
+
+async def close_rate_limiter() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
+
+
+async def admit(key: str, limit: RateLimit) -> None:
+    redis_buckets = get_redis_buckets()
+    if redis_buckets is not None:
+        retry_after = await redis_buckets.take(key, limit)
+    else:
+        retry_after = _memory.take(key, limit)
+
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def route_key(request: Request) -> str:
+    route = request.scope.get("route")
+    return f"{request.method} {route.path if route is not None else request.url.path}"
+
+
+def rate_limiter(config: dict, authenticated: bool) -> Callable:
+    """FastAPI dependency enforcing the limit of a router."""
+    limit = RateLimit.from_config(config)
+
+    if authenticated:
+        async def limit_user(request: Request, user: AuthorizedUser) -> None:
+            await admit(f"{user.sub}:{route_key(request)}", limit)
+
+        return limit_user
+
+    async def limit_client(request: Request) -> None:
+        client = request.client.host if request.client else "unknown"
+        await admit(f"{client}:{route_key(request)}", limit)
+
+    return limit_client
+
+
+__all__ = [
+    "MemoryBuckets",
+    "RateLimit",
+    "RedisBuckets",
+    "close_rate_limiter",
+    "is_enabled",
+    "rate_limiter",
+]
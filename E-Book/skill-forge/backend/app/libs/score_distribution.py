@@ -0,0 +1,237 @@
+"""Per-skill score distributions for percentile ranks.
+
+Usage:
+
+    from app.libs.score_distribution import distributions
+
+    distributions.record("python", 85)
+    rank = distributions.percentile_rank("python", 85)
+
+Scores are integers from 0 to 100, so a fixed histogram with one bin per
+score is exact. Lookups read a precomputed cumulative array and take
+constant time.
+
+Each process keeps its histograms in memory. New scores are applied locally
+right away and accumulated as deltas that a background loop periodically
+adds to the skill_score_counts table, before reloading the merged counts
+written by every other process.
+
+The skill_score_counts table is created by a one-off migration, run once
+per database:
+
+    python -m app.libs.score_distribution
+
+The loop starts even when the database is unreachable or not migrated yet,
+and keeps retrying the initial backfill and load until they succeed.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+
+from app.libs.database import Intent, connection, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+MAX_SCORE = 100
+
+SYNC_INTERVAL = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS skill_score_counts (
+    skill_name TEXT NOT NULL,
+    score INT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (skill_name, score)
+);
+"""
+
+
+class ScoreHistogram:
+    def __init__(self, counts: list[int] | None = None):
+        self.counts = counts or [0] * (MAX_SCORE + 1)
+        self._below: list[int] | None = None
+
+    @property
+    def total(self) -> int:
+        return self._cumulative()[-1]
+
+    def add(self, score: int, n: int = 1) -> None:
+        self.counts[score] += n
+        self._below = None
+
+    def _cumulative(self) -> list[int]:
+        # _below[i] is the number of scores strictly below i
+        if self._below is None:
+            below = [0] * (MAX_SCORE + 2)
+            for i, c in enumerate(self.counts):
+                below[i + 1] = below[i] + c
+            self._below = below
+        return self._below
+
+    def percentile_rank(self, score: int) -> float | None:
+        """Percentage of scores below `score`, counting ties as half."""
+        below = self._cumulative()
+        total = below[-1]
+        if total == 0:
+            return None
+        at = self.counts[score]
+        return 100.0 * (below[score] + 0.5 * at) / total
+
+
+def clamp(score: int) -> int:
+    return max(0, min(MAX_SCORE, score))
+
+
+class ScoreDistributions:
+    def __init__(self):
+        self._histograms: dict[str, ScoreHistogram] = defaultdict(ScoreHistogram)
+        self._pending: dict[tuple[str, int], int] = defaultdict(int)
+        self._sync_task: asyncio.Task | None = None
+        self._loaded = False
+
+    def record(self, skill_name: str, score: int) -> None:
+        score = clamp(score)
+        self._histograms[skill_name].add(score)
+        self._pending[(skill_name, score)] += 1
+
+    def percentile_rank(self, skill_name: str, score: int) -> float | None:
+        histogram = self._histograms.get(skill_name)
+        if histogram is None:
+            return None
+        return histogram.percentile_rank(clamp(score))
+
+    def sample_size(self, skill_name: str) -> int:
+        histogram = self._histograms.get(skill_name)
+        return histogram.total if histogram is not None else 0
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(int)
+        flushed = False
+        try:
+            async with connection(Intent.WRITE) as conn:
+                await conn.executemany(
+                    """
+                    INSERT INTO skill_score_counts (skill_name, score, count) VALUES ($1, $2, $3)
+                    ON CONFLICT (skill_name, score) DO UPDATE SET count = skill_score_counts.count + EXCLUDED.count
+                    """,
+                    [(skill, score, n) for (skill, score), n in pending.items()],
+                )
+            flushed = True
+        finally:
+            if not flushed:
+                # Failed or cancelled, keep the deltas for the next attempt
+                for key, n in pending.items():
+                    self._pending[key] += n
+
+    async def load(self) -> None:
+        async with connection(Intent.WRITE) as conn:
+            rows = await conn.fetch("SELECT skill_name, score, count FROM skill_score_counts")
+
+        histograms: dict[str, ScoreHistogram] = defaultdict(ScoreHistogram)
+        for row in rows:
+            histograms[row['skill_name']].add(clamp(row['score']), row['count'])
+        # Deltas not yet flushed are still only known locally
+        for (skill, score), n in self._pending.items():
+            histograms[skill].add(score, n)
+        self._histograms = histograms
+
+    async def backfill(self) -> bool:
+        """Seed the counts from completed assessments if the table is empty.
+
+        Returns whether it did.
+        """
+        async with connection(Intent.WRITE) as conn:
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE skill_score_counts IN EXCLUSIVE MODE")
+                if await conn.fetchval("SELECT 1 FROM skill_score_counts LIMIT 1"):
+                    return False
+                await conn.execute(
+                    """
+                    INSERT INTO skill_score_counts (skill_name, score, count)
+                    SELECT skill_name, LEAST(GREATEST(score, 0), 100), COUNT(*) FROM assessments
+                    WHERE status = 'completed' AND score IS NOT NULL
+                    GROUP BY 1, 2
+                    """
+                )
+        return True
+
+    async def _initial_load(self) -> None:
+        # Scores recorded so far belong to assessments the seed already counts
+        recorded = dict(self._pending)
+        if await self.backfill():
+            for key, n in recorded.items():
+                self._pending[key] -= n
+                if not self._pending[key]:
+                    del self._pending[key]
+        await self.load()
+        self._loaded = True
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SYNC_INTERVAL)
+            try:
+                if self._loaded:
+                    await self.flush()
+                    await self.load()
+                else:
+                    await self._initial_load()
+            except Exception as e:
+                logger.warning("Score distribution sync failed: %s", e)
+
+    async def start(self) -> None:
+        # Started first, so a database that is down at boot is retried
+        self._sync_task = asyncio.create_task(self._sync_loop())
+        await self._initial_load()
+
+    async def stop(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            # Let a flush in progress put its deltas back before the final one
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        # Before the initial backfill, flushing would keep it from seeding
+        if self._loaded:
+            await self.flush()
+
+
+distributions = ScoreDistributions()
+
+
+async def migrate() -> None:
+    conn = await get_db_connection()
+    try:
+        await conn.execute(SCHEMA)
+    finally:
+        await conn.close()
+
+
+async def start_score_sync() -> None:
+    try:
+        await distributions.start()
+    except Exception as e:
+        logger.warning("Score distributions unavailable, retrying in the background: %s", e)
+
+
+async def stop_score_sync() -> None:
+    try:
+        await distributions.stop()
+    except Exception as e:
+        logger.warning("Failed to flush score distributions: %s", e)
+
+
+__all__ = [
+    "ScoreDistributions",
+    "ScoreHistogram",
+    "distributions",
+    "migrate",
+    "start_score_sync",
+    "stop_score_sync",
+]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -0,0 +1,401 @@
+"""Durable background tasks stored in Postgres.
+
+Usage:
+
+    from app.libs.task_queue import task
+
+    class SendEmail(BaseModel):
+        user_id: str
+
+    @task("email.send", queue="email")
+    async def send_email(payload: SendEmail) -> None:
+        ...
+
+    # Inside a request handler, in the same transaction as its writes
+    async with conn.transaction():
+        await conn.execute("INSERT ...")
+        await send_email.enqueue(conn, SendEmail(user_id=user.sub), key=f"welcome:{user.sub}")
+
+Tasks become visible to workers only when the surrounding transaction
+commits. Workers claim rows with FOR UPDATE SKIP LOCKED, so any number of
+processes can share a queue. Failed tasks are retried with exponential
+backoff until `max_attempts` is reached. A task `key` makes enqueueing
+idempotent: a second enqueue with the same key is ignored.
+
+Completed tasks are deleted after TASK_RETENTION_HOURS (default 24), failed
+ones are kept for inspection.
+
+The background_tasks table is created by a one-off migration, run once per
+database:
+
+    python -m app.libs.task_queue
+
+The app only checks on startup that it exists. Workers start either way and
+keep retrying, so they pick up work once the database is reachable and
+migrated.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import typing
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, TypeVar
+
+import asyncpg
+from pydantic import BaseModel
+
+from app.libs.database import Intent, connection, get_db_connection
+from app.libs.metrics import TASK_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+P = TypeVar("P", bound=BaseModel)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS background_tasks (
+    id BIGSERIAL PRIMARY KEY,
+    queue TEXT NOT NULL,
+    name TEXT NOT NULL,
+    task_key TEXT UNIQUE,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS background_tasks_ready_idx
+    ON background_tasks (queue, run_at) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS background_tasks_done_idx
+    ON background_tasks (completed_at) WHERE status = 'done';
+"""
+
+NOTIFY_CHANNEL = "background_tasks"
+
+# A running task whose worker has not reported back after this long is
+# assumed lost (e.g. the process was killed) and is claimed again.
+LOCK_TIMEOUT_SECONDS = 300.0
+
+DEFAULT_CONCURRENCY = 2
+
+# Seconds between samples of the number of pending tasks per queue
+DEPTH_SAMPLE_INTERVAL = 15.0
+
+# Seconds between deletions of old completed tasks, and rows per batch
+PURGE_INTERVAL = 600.0
+PURGE_BATCH_SIZE = 1000
+
+
+@dataclass
+class Task(Generic[P]):
+    name: str
+    queue: str
+    payload_model: type[P]
+    func: Callable[[P], Awaitable[None]]
+    max_attempts: int = 5
+    backoff_base: float = 2.0
+    backoff_max: float = 600.0
+
+    async def enqueue(
+        self,
+        conn: asyncpg.Connection,
+        payload: P,
+        key: str | None = None,
+        delay: float = 0.0,
+    ) -> int | None:
+        """Insert the task on `conn`. Returns None if `key` was already used."""
+        task_id = await conn.fetchval(
+            """
+            INSERT INTO background_tasks (queue, name, task_key, payload, max_attempts, run_at)
+            VALUES ($1, $2, $3, $4::jsonb, $5, NOW() + make_interval(secs => $6))
+            ON CONFLICT (task_key) DO NOTHING
+            RETURNING id
+            """,
+            self.queue,
+            self.name,
+            key,
+            payload.model_dump_json(),
+            self.max_attempts,
+            float(delay),
+        )
+        if task_id is not None:
+            # Delivered to listening workers when the transaction commits
+            await conn.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, self.queue)
+        return task_id
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_base**attempts, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+
+_registry: dict[str, Task] = {}
+
+
+def task(
+    name: str,
+    queue: str = "default",
+    max_attempts: int = 5,
+) -> Callable[[Callable[[P], Awaitable[None]]], Task[P]]:
+    """Register an async handler. Its payload type is taken from its annotation."""
+
+    def decorator(func: Callable[[P], Awaitable[None]]) -> Task[P]:
+        hints = typing.get_type_hints(func)
+        hints.pop("return", None)
+        if len(hints) != 1:
+            raise TypeError(f"Task handler {name} must take a single annotated payload")
+        (payload_model,) = hints.values()
+
+        handler = Task(
+            name=name,
+            queue=queue,
+            payload_model=payload_model,
+            func=func,
+            max_attempts=max_attempts,
+        )
+        _registry[name] = handler
+        return handler
+
+    return decorator
+
+
+def get_concurrency() -> dict[str, int]:
+    """Workers per queue, from TASK_QUEUE_CONCURRENCY (e.g. "telemetry=4,badges=1")."""
+    concurrency = {t.queue: DEFAULT_CONCURRENCY for t in _registry.values()}
+    for part in os.environ.get("TASK_QUEUE_CONCURRENCY", "").split(","):
+        if "=" in part:
+            queue, n = part.split("=", 1)
+            concurrency[queue.strip()] = int(n)
+    return concurrency
+
+
+async def migrate() -> None:
+    conn = await get_db_connection()
+    try:
+        await conn.execute(SCHEMA)
+    finally:
+        await conn.close()
+
+
+async def check_schema() -> None:
+    """Warn when the migration hasn't been applied, never fails startup."""
+    try:
+        async with connection(Intent.READ) as conn:
+            ready = await conn.fetchval("SELECT to_regclass('background_tasks') IS NOT NULL")
+    except Exception as e:
+        logger.warning("Could not check the task queue schema: %s", e)
+        return
+    if not ready:
+        logger.warning("Background tasks are unavailable, run `python -m app.libs.task_queue` to migrate")
+
+
+class WorkerPool:
+    """Runs registered handlers for every queue with the configured concurrency."""
+
+    def __init__(self, concurrency: dict[str, int], poll_interval: float = 5.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeups = {queue: asyncio.Event() for queue in concurrency}
+        self._workers: list[asyncio.Task] = []
+        self._listener: asyncpg.Connection | None = None
+        self._stopping = False
+        self._stopped = asyncio.Event()
+
+    async def start(self) -> None:
+        try:
+            self._listener = await get_db_connection()
+            await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        except Exception as e:
+            # Polling still picks up work, just with more latency
+            logger.warning("Task queue listener unavailable: %s", e)
+
+        for queue, n in self.concurrency.items():
+            for _ in range(n):
+                self._workers.append(asyncio.create_task(self._run(queue)))
+        self._workers.append(asyncio.create_task(self._sample_depth()))
+        self._workers.append(asyncio.create_task(self._purge_done()))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._stopped.set()
+        for event in self._wakeups.values():
+            event.set()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def _on_notify(self, conn, pid, channel, queue: str) -> None:
+        event = self._wakeups.get(queue)
+        if event is not None:
+            event.set()
+
+    async def _sample_depth(self) -> None:
+        while not self._stopping:
+            try:
+                async with connection(Intent.READ) as conn:
+                    rows = await conn.fetch(
+                        "SELECT queue, COUNT(*) AS depth FROM background_tasks WHERE status = 'pending' GROUP BY queue"
+                    )
+                depths = {row["queue"]: row["depth"] for row in rows}
+                for queue in self.concurrency:
+                    TASK_QUEUE_DEPTH.labels(queue).set(depths.get(queue, 0))
+            except Exception as e:
+                logger.warning("Failed to sample task queue depth: %s", e)
+
+            try:
+                await asyncio.wait_for(self._stopped.wait(), DEPTH_SAMPLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _purge_done(self) -> None:
+        retention_hours = float(os.environ.get("TASK_RETENTION_HOURS", "24"))
+        while not self._stopping:
+            try:
+                deleted = PURGE_BATCH_SIZE
+                # Small batches keep locks short, workers of every process may run this
+                while deleted == PURGE_BATCH_SIZE and not self._stopping:
+                    async with connection(Intent.WRITE) as conn:
+                        status = await conn.execute(
+                            """
+                            DELETE FROM background_tasks WHERE id IN (
+                                SELECT id FROM background_tasks
+                                WHERE status = 'done' AND completed_at < NOW() - make_interval(secs => $1)
+                                LIMIT $2
+                                FOR UPDATE SKIP LOCKED
+                            )
+                            """,
+                            retention_hours * 3600,
+                            PURGE_BATCH_SIZE,
+                        )
+                    deleted = int(status.rsplit(" ", 1)[-1])
+            except Exception as e:
+                logger.warning("Failed to purge completed tasks: %s", e)
+
+            try:
+                await asyncio.wait_for(self._stopped.wait(), PURGE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, queue: str) -> None:
+        wakeup = self._wakeups[queue]
+        while not self._stopping:
+            try:
+                ran = await self.run_one(queue)
+            except Exception as e:
+                logger.warning("Task worker for queue '%s' failed to claim: %s", queue, e)
+                ran = False
+            if ran:
+                continue
+
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_one(self, queue: str) -> bool:
+        """Claim and execute a single task. Returns False if the queue was empty."""
+        async with connection(Intent.WRITE) as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE background_tasks
+                SET status = 'running', attempts = attempts + 1, locked_at = NOW()
+                WHERE id = (
+                    SELECT id FROM background_tasks
+                    WHERE queue = $1 AND (
+                        (status = 'pending' AND run_at <= NOW())
+                        OR (status = 'running' AND locked_at < NOW() - make_interval(secs => $2))
+                    )
+                    ORDER BY run_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, name, payload, attempts, max_attempts
+                """,
+                queue,
+                LOCK_TIMEOUT_SECONDS,
+            )
+        if row is None:
+            return False
+
+        handler = _registry.get(row["name"])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for task {row['name']}")
+            payload = handler.payload_model.model_validate(json.loads(row["payload"]))
+            await handler.func(payload)
+        except Exception as e:
+            await self._record_failure(row, handler, e)
+        else:
+            async with connection(Intent.WRITE) as conn:
+                await conn.execute(
+                    "UPDATE background_tasks SET status = 'done', completed_at = NOW(), last_error = NULL WHERE id = $1",
+                    row["id"],
+                )
+        return True
+
+    async def _record_failure(self, row, handler: Task | None, error: Exception) -> None:
+        logger.warning(
+            "Task %s (%s) failed on attempt %s: %s", row["name"], row["id"], row["attempts"], error
+        )
+        if handler is None or row["attempts"] >= row["max_attempts"]:
+            status, delay = "failed", 0.0
+        else:
+            status, delay = "pending", handler.backoff(row["attempts"])
+
+        async with connection(Intent.WRITE) as conn:
+            await conn.execute(
+                """
+                UPDATE background_tasks
+                SET status = $2, run_at = NOW() + make_interval(secs => $3), locked_at = NULL, last_error = $4
+                WHERE id = $1
+                """,
+                row["id"],
+                status,
+                delay,
+                repr(error),
+            )
+
+
+_pool: WorkerPool | None = None
+
+
+async def start_workers() -> None:
+    global _pool
+    # Request handlers enqueue tasks even when this process runs no workers
+    await check_schema()
+    if os.environ.get("TASK_WORKERS_ENABLED", "true").lower() in ("0", "false", "no"):
+        logger.info("Background task workers disabled")
+        return
+    _pool = WorkerPool(get_concurrency())
+    await _pool.start()
+
+
+async def stop_workers() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.stop()
+        _pool = None
+
+
+__all__ = [
+    "Task",
+    "WorkerPool",
+    "check_schema",
+    "migrate",
+    "start_workers",
+    "stop_workers",
+    "task",
+]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -0,0 +1,63 @@
+"""Per-worker warmup, run during app startup before the worker accepts traffic.
+
+Each step is timed and isolated: a failing step is logged and the worker
+still starts, it just pays that cost on the first request instead.
+"""
+
+import asyncio
+import importlib
+import logging
+import time
+
+from fastapi import FastAPI
+
+from app.libs.database import get_router
+
+logger = logging.getLogger(__name__)
+
+
+async def prefill_pools() -> None:
+    # Creating a pool opens its min_size connections up front
+    router = get_router()
+    await router.primary_pool()
+    for url in router.replica_urls:
+        await router.replica_pool(url)
+
+
+async def fetch_jwks(app: FastAPI) -> None:
+    from databutton_app.mw.auth_mw import get_jwks_client
+
+    auth_config = app.state.auth_config
+    if auth_config is None:
+        return
+    # Populates the client's key set cache so the first token is verified without a fetch
+    client = get_jwks_client(auth_config.jwks_url)
+    await asyncio.to_thread(client.get_signing_keys)
+
+
+async def load_question_bank() -> None:
+    assessments = importlib.import_module("app.apis.assessments")
+    for questions in assessments.QUESTION_BANK.values():
+        for q in questions:
+            assessments.AssessmentQuestion(id=0, question_text=q["question_text"], options=q["options"])
+
+
+async def _timed(name: str, step) -> None:
+    started = time.perf_counter()
+    try:
+        await step
+    except Exception as e:
+        logger.warning("Warmup step %s failed: %s", name, e)
+        return
+    logger.info("Warmup step %s done", name, extra={"duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+
+
+async def warmup(app: FastAPI) -> None:
+    await asyncio.gather(
+        _timed("prefill_pools", prefill_pools()),
+        _timed("fetch_jwks", fetch_jwks(app)),
+        _timed("load_question_bank", load_question_bank()),
+    )
+
+
+__all__ = ["warmup"]
@@ -0,0 +1,89 @@
+"""Measure the per-request cost of MetricsMiddleware.
+
+Usage:
+
+    python -m benchmarks.metrics_overhead [--requests 20000] [--max-overhead-us 50]
+
+Drives a FastAPI app with a realistic number of routes directly through
+ASGI, with and without the middleware, and reports the difference per
+request. Exits with status 1 if it exceeds --max-overhead-us.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi import FastAPI
+
+from mw.metrics_mw import MetricsMiddleware
+
+
+def build_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+    for i in range(20):
+        app.add_api_route(f"/routes/resource{i}/{{item_id}}", lambda item_id: None, methods=["GET"])
+
+    @app.get("/routes/assessments/{assessment_id}")
+    async def get_assessment(assessment_id: int):
+        return {"id": assessment_id}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def drive(app: FastAPI, n: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/routes/assessments/42",
+        "raw_path": b"/routes/assessments/42",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Warm up caches and lazily built middleware stacks
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+
+    started = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / n
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--max-overhead-us", type=float, default=50.0)
+    args = parser.parse_args()
+
+    baseline = asyncio.run(drive(build_app(with_metrics=False), args.requests))
+    metered = asyncio.run(drive(build_app(with_metrics=True), args.requests))
+    overhead_us = (metered - baseline) * 1e6
+
+    print(f"without metrics: {baseline * 1e6:8.1f} us/request")
+    print(f"with metrics:    {metered * 1e6:8.1f} us/request")
+    print(f"overhead:        {overhead_us:8.1f} us/request")
+
+    if overhead_us > args.max_overhead_us:
+        print(f"Metrics overhead above {args.max_overhead_us} us")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
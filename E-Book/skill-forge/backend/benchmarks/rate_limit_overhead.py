@@ -0,0 +1,79 @@
+"""Measure the per-request cost of the rate limiter.
+
+Usage:
+
+    python -m benchmarks.rate_limit_overhead [--requests 200000] [--max-overhead-us 5]
+    python -m benchmarks.rate_limit_overhead --redis-url redis://localhost:6379/0
+
+Times a token check against the in-memory buckets, spread over many users
+like in production, and exits with status 1 if it exceeds
+--max-overhead-us. With --redis-url it also checks the shared mode against
+that Redis: a user's burst is admitted and the next request is refused with
+a retry delay, then the round trip is timed (reported, not enforced, as it
+is dominated by the network).
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+from app.libs.rate_limit import MemoryBuckets, RateLimit, RedisBuckets
+
+LIMIT = RateLimit(rate=1.0, burst=60)
+
+
+def measure_memory(n: int, users: int) -> float:
+    buckets = MemoryBuckets()
+    keys = [f"user-{i}:POST /routes/ask-ai" for i in range(users)]
+    for key in keys:
+        buckets.take(key, LIMIT)
+
+    started = time.perf_counter()
+    for i in range(n):
+        buckets.take(keys[i % users], LIMIT)
+    return (time.perf_counter() - started) / n
+
+
+async def check_redis(url: str, n: int) -> float:
+    buckets = RedisBuckets(url)
+    try:
+        limit = RateLimit(rate=0.5, burst=3)
+        key = f"bench-{uuid.uuid4().hex}:GET /routes/example"
+        admitted = [await buckets.take(key, limit) for _ in range(limit.burst)]
+        refused = await buckets.take(key, limit)
+        if any(admitted) or not refused > 0:
+            raise RuntimeError(f"Unexpected Redis bucket behaviour: {admitted}, {refused}")
+
+        started = time.perf_counter()
+        for i in range(n):
+            await buckets.take(f"bench-{i % 100}:GET /routes/example", LIMIT)
+        return (time.perf_counter() - started) / n
+    finally:
+        await buckets.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--max-overhead-us", type=float, default=5.0)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    memory_us = measure_memory(args.requests, args.users) * 1e6
+    print(f"in-memory: {memory_us:8.2f} us/request")
+
+    if args.redis_url:
+        redis_us = asyncio.run(check_redis(args.redis_url, min(args.requests, 5_000))) * 1e6
+        print(f"redis:     {redis_us:8.2f} us/request")
+
+    if memory_us > args.max_overhead_us:
+        print(f"Rate limiter overhead above {args.max_overhead_us} us")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Check read/write routing against a local primary and replica.
+
+Usage:
+
+    python -m benchmarks.replica_routing --primary-url postgresql://localhost:5432/app \\
+        --replica-url postgresql://localhost:5433/app
+
+The urls default to BENCH_PRIMARY_URL and BENCH_REPLICA_URL, and the check
+is skipped (status 0) when they aren't set. The two urls must point at
+different instances; a streaming replica isn't required, as only the
+routing is checked, not the data.
+
+Covers reads going to the replica, read-your-writes (in process and from
+the client's marker, including a bogus future marker), concurrent first
+callers sharing one pool, and falling back from an unreachable replica to
+the next one or the primary, with the cooldown before it is retried.
+Exits with status 1 on the first failed check.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+
+from app.libs import database
+from app.libs.database import ConnectionRouter, Intent
+
+# Nothing listens here, connecting fails right away
+UNREACHABLE_URL = "postgresql://postgres@127.0.0.1:1/unreachable"
+
+COOLDOWN = 0.5
+
+
+class CountingRouter(ConnectionRouter):
+    """Counts pools created per url."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created: dict[str, int] = {}
+
+    async def _create_pool(self, url: str) -> asyncpg.Pool:
+        self.created[url] = self.created.get(url, 0) + 1
+        return await super()._create_pool(url)
+
+
+async def server_id(url: str) -> tuple:
+    conn = await asyncpg.connect(url)
+    try:
+        return tuple(await conn.fetchrow("SELECT inet_server_addr(), inet_server_port(), current_database()"))
+    finally:
+        await conn.close()
+
+
+async def served_by(router: ConnectionRouter, intent: Intent, user_id=None, last_write=None) -> tuple:
+    async with router.acquire(intent, user_id, last_write) as conn:
+        return tuple(await conn.fetchrow("SELECT inet_server_addr(), inet_server_port(), current_database()"))
+
+
+def check(name: str, ok: bool) -> None:
+    print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not ok:
+        raise SystemExit(1)
+
+
+async def run(primary_url: str, replica_url: str) -> None:
+    primary, replica = await server_id(primary_url), await server_id(replica_url)
+    if primary == replica:
+        raise SystemExit("The primary and replica urls point at the same instance")
+    database.REPLICA_COOLDOWN = COOLDOWN
+
+    router = CountingRouter(primary_url, [replica_url], read_your_writes_window=1.0)
+    try:
+        results = await asyncio.gather(*(served_by(router, Intent.READ) for _ in range(20)))
+        check("reads go to the replica", set(results) == {replica})
+        check("concurrent first reads share one pool", router.created == {replica_url: 1})
+        check("writes go to the primary", await served_by(router, Intent.WRITE, "alice") == primary)
+        check("the writer reads from the primary", await served_by(router, Intent.READ, "alice") == primary)
+        check("other users read from the replica", await served_by(router, Intent.READ, "bob") == replica)
+        check(
+            "a recent client marker reads from the primary",
+            await served_by(router, Intent.READ, "carol", time.time()) == primary,
+        )
+        check(
+            "a future client marker is ignored",
+            await served_by(router, Intent.READ, "carol", time.time() + 3600) == replica,
+        )
+        await asyncio.sleep(1.0)
+        check("the writer is back on the replica after the window", await served_by(router, Intent.READ, "alice") == replica)
+    finally:
+        await router.close()
+
+    router = CountingRouter(primary_url, [UNREACHABLE_URL, replica_url])
+    try:
+        check("an unreachable replica falls back to the next one", await served_by(router, Intent.READ) == replica)
+        attempts = router.created.get(UNREACHABLE_URL, 0)
+        await served_by(router, Intent.READ)
+        await served_by(router, Intent.READ)
+        check("it is skipped during the cooldown", router.created.get(UNREACHABLE_URL, 0) == attempts)
+        await asyncio.sleep(COOLDOWN)
+        await served_by(router, Intent.READ)
+        await served_by(router, Intent.READ)
+        check("it is retried after the cooldown", router.created.get(UNREACHABLE_URL, 0) > attempts)
+    finally:
+        await router.close()
+
+    router = CountingRouter(primary_url, [UNREACHABLE_URL])
+    try:
+        check("no healthy replica falls back to the primary", await served_by(router, Intent.READ) == primary)
+    finally:
+        await router.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--primary-url", default=os.environ.get("BENCH_PRIMARY_URL"))
+    parser.add_argument("--replica-url", default=os.environ.get("BENCH_REPLICA_URL"))
+    args = parser.parse_args()
+
+    if not args.primary_url or not args.replica_url:
+        print("skipped: set BENCH_PRIMARY_URL and BENCH_REPLICA_URL to two local instances")
+        return 0
+    asyncio.run(run(args.primary_url, args.replica_url))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
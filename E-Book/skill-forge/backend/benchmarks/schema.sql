@@ -0,0 +1,52 @@
+-- Tables the load test needs in a fresh local database. The app's support
+-- tables (background tasks, score counts, search indexes) come from its
+-- migrations, see MIGRATIONS in load_test.py.
+
+CREATE TABLE IF NOT EXISTS assessments (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    skill_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'inprogress',
+    score INT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS assessment_items (
+    id BIGSERIAL PRIMARY KEY,
+    assessment_id BIGINT NOT NULL REFERENCES assessments (id) ON DELETE CASCADE,
+    question_text TEXT NOT NULL,
+    options JSONB NOT NULL,
+    correct_answer_index INT NOT NULL,
+    user_answer_index INT,
+    is_correct BOOLEAN
+);
+CREATE INDEX IF NOT EXISTS assessment_items_assessment_idx ON assessment_items (assessment_id);
+
+CREATE TABLE IF NOT EXISTS badges (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    assessment_id BIGINT NOT NULL REFERENCES assessments (id) ON DELETE CASCADE,
+    skill_name TEXT NOT NULL,
+    skill_level TEXT NOT NULL,
+    issued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    signed_vc_jwt TEXT
+);
+CREATE INDEX IF NOT EXISTS badges_user_idx ON badges (user_id);
+CREATE INDEX IF NOT EXISTS badges_assessment_idx ON badges (assessment_id);
+
+CREATE TABLE IF NOT EXISTS orgs (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    org_id BIGINT NOT NULL REFERENCES orgs (id),
+    title TEXT NOT NULL,
+    description TEXT,
+    skill_graph_json JSONB,
+    location_type TEXT,
+    status TEXT NOT NULL DEFAULT 'open',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
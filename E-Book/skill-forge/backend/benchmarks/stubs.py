@@ -0,0 +1,94 @@
+"""Stand-in services for the load test: a JWKS issuer and an AI upstream.
+
+`StubIssuer` serves an RS256 key set at /jwks.json and signs test tokens
+with the matching private key, so they pass `mw/auth_mw.py` unchanged once
+the app is started with AUTH_JWKS_URL and AUTH_AUDIENCE pointing at it.
+
+`StubAI` answers /chat/completions in the OpenAI response format after a
+fixed delay, standing in for the upstream behind OPENAI_BASE_URL.
+"""
+
+import asyncio
+import time
+
+import jwt
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+KEY_ID = "bench-key"
+
+
+class StubIssuer:
+    def __init__(self, audience: str, issuer: str = "skill-forge-bench"):
+        self.audience = audience
+        self.issuer = issuer
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = self._private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+
+    def jwks(self) -> dict:
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key(), as_dict=True)
+        return {"keys": [{**jwk, "kid": KEY_ID, "alg": "RS256", "use": "sig"}]}
+
+    def issue_token(self, sub: str, ttl: int = 3600) -> str:
+        now = int(time.time())
+        claims = {
+            "sub": sub,
+            "aud": self.audience,
+            "iss": self.issuer,
+            "iat": now,
+            "exp": now + ttl,
+        }
+        return jwt.encode(claims, self._private_pem, algorithm="RS256", headers={"kid": KEY_ID})
+
+    def build_app(self) -> web.Application:
+        async def jwks(request: web.Request) -> web.Response:
+            return web.json_response(self.jwks())
+
+        app = web.Application()
+        app.router.add_get("/jwks.json", jwks)
+        return app
+
+
+class StubAI:
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+
+    def build_app(self) -> web.Application:
+        async def chat_completions(request: web.Request) -> web.Response:
+            body = await request.json()
+            await asyncio.sleep(self.latency)
+            return web.json_response(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "This is a stub answer."},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 6, "total_tokens": 16},
+                }
+            )
+
+        app = web.Application()
+        app.router.add_post("/chat/completions", chat_completions)
+        return app
+
+
+async def serve(app: web.Application, host: str = "127.0.0.1") -> tuple[web.AppRunner, str]:
+    """Serve `app` on a free port, returns the runner and the base url."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
@@ -1,18 +1,38 @@
+import functools
+import importlib
 import os
 import pathlib
 import json
+import logging
 import dotenv
 from fastapi import FastAPI, APIRouter, Depends
 
 dotenv.load_dotenv()
 
+from databutton_app.mw.logging_mw import RequestIdMiddleware, configure_logging
+
+configure_logging()
+
 from databutton_app.mw.auth_mw import AuthConfig, get_authorized_user
+from databutton_app.mw.metrics_mw import MetricsMiddleware, metrics_endpoint
+from app.libs.badge_credentials import close_signer, start_resign_sweep, stop_resign_sweep
+from app.libs.database import DatabaseUnavailable, close_pools, database_unavailable_handler
+from app.libs.db_instrumentation import QueryStatsMiddleware
+from app.libs.idempotency import IdempotencyMiddleware
+from app.libs.job_search import check_search_schema
+from app.libs.profiler import ProfilerMiddleware, is_enabled as profiler_enabled
+from app.libs.rate_limit import close_rate_limiter, rate_limiter, is_enabled as rate_limits_enabled
+from app.libs.score_distribution import start_score_sync, stop_score_sync
+from app.libs.task_queue import start_workers, stop_workers
+from app.libs.warmup import warmup
+
+logger = logging.getLogger(__name__)
 
 
 def get_router_config() -> dict:
     try:
         # Note: This file is not available to the agent
-        cfg = json.loads(open("routers.json").read())
+        cfg = json.loads((pathlib.Path(__file__).parent / "routers.json").read_text())
     except:
         return False
     return cfg
@@ -22,44 +42,46 @@ def is_auth_disabled(router_config: dict, name: str) -> bool:
     return router_config["routers"][name]["disableAuth"]
 
 
-def import_api_routers() -> APIRouter:
-    """Create top level router including all user defined endpoints."""
-    routes = APIRouter(prefix="/routes")
-
-    router_config = get_router_config()
+def get_rate_limit(router_config: dict, name: str) -> dict | None:
+    if not router_config or not rate_limits_enabled():
+        return None
+    return router_config["routers"][name].get("rateLimit")
 
-    src_path = pathlib.Path(__file__).parent
 
-    # Import API routers from "src/app/apis/*/__init__.py"
-    apis_path = src_path / "app" / "apis"
+def get_api_names(router_config: dict) -> list[str]:
+    """Routers listed in routers.json, falling back to scanning app/apis."""
+    if router_config:
+        return list(router_config["routers"])
 
-    api_names = [
+    apis_path = pathlib.Path(__file__).parent / "app" / "apis"
+    return [
         p.relative_to(apis_path).parent.as_posix()
         for p in apis_path.glob("*/__init__.py")
     ]
 
+
+def import_api_routers() -> APIRouter:
+    """Create top level router including all user defined endpoints."""
+    routes = APIRouter(prefix="/routes")
+
+    router_config = get_router_config()
+
     api_module_prefix = "app.apis."
 
-    for name in api_names:
-        print(f"Importing API: {name}")
+    for name in get_api_names(router_config):
         try:
-            api_module = __import__(api_module_prefix + name, fromlist=[name])
+            api_module = importlib.import_module(api_module_prefix + name)
             api_router = getattr(api_module, "router", None)
             if isinstance(api_router, APIRouter):
-                routes.include_router(
-                    api_router,
-                    dependencies=(
-                        []
-                        if is_auth_disabled(router_config, name)
-                        else [Depends(get_authorized_user)]
-                    ),
-                )
-        except Exception as e:
-            print(e)
+                auth_disabled = is_auth_disabled(router_config, name) if router_config else False
+                dependencies = [] if auth_disabled else [Depends(get_authorized_user)]
+                if rate_limit := get_rate_limit(router_config, name):
+                    dependencies.append(Depends(rate_limiter(rate_limit, authenticated=not auth_disabled)))
+                routes.include_router(api_router, dependencies=dependencies)
+        except Exception:
+            logger.exception("Failed to import API %s", name)
             continue
 
-    print(routes.routes)
-
     return routes
 
 
@@ -78,19 +100,43 @@ def create_app() -> FastAPI:
     """Create the app. This is called by uvicorn with the factory option to construct the app object."""
     app = FastAPI()
     app.include_router(import_api_routers())
-
-    for route in app.routes:
-        if hasattr(route, "methods"):
-            for method in route.methods:
-                print(f"{method} {route.path}")
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+    app.add_exception_handler(DatabaseUnavailable, database_unavailable_handler)
+    # Innermost, so replayed responses are still counted and get a request id
+    app.add_middleware(IdempotencyMiddleware)
+    if profiler_enabled():
+        # Close to the app, so the profile covers only the request handling itself
+        app.add_middleware(ProfilerMiddleware)
+    app.add_middleware(QueryStatsMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(RequestIdMiddleware)
+    app.add_event_handler("startup", functools.partial(warmup, app))
+    app.add_event_handler("startup", check_search_schema)
+    app.add_event_handler("startup", start_score_sync)
+    app.add_event_handler("startup", start_workers)
+    app.add_event_handler("startup", start_resign_sweep)
+    app.add_event_handler("shutdown", stop_resign_sweep)
+    app.add_event_handler("shutdown", stop_workers)
+    app.add_event_handler("shutdown", stop_score_sync)
+    app.add_event_handler("shutdown", close_signer)
+    app.add_event_handler("shutdown", close_rate_limiter)
+    app.add_event_handler("shutdown", close_pools)
 
     firebase_config = get_firebase_config()
 
-    if firebase_config is None:
-        print("No firebase config found")
+    if jwks_url := os.environ.get("AUTH_JWKS_URL"):
+        # Explicit key set, e.g. the stub issuer of the load test harness
+        logger.info("Using auth config from environment")
+        app.state.auth_config = AuthConfig(
+            jwks_url=jwks_url,
+            audience=os.environ["AUTH_AUDIENCE"],
+            header="authorization",
+        )
+    elif firebase_config is None:
+        logger.info("No firebase config found")
         app.state.auth_config = None
     else:
-        print("Firebase config found")
+        logger.info("Firebase config found")
         auth_config = {
             "jwks_url": "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com",
             "audience": firebase_config["projectId"],
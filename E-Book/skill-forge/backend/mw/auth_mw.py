@@ -1,4 +1,6 @@
 import functools
+import logging
+import time
 from http import HTTPStatus
 from typing import Annotated, Callable
 import jwt
@@ -8,6 +10,10 @@ from jwt import PyJWKClient
 from pydantic import BaseModel
 from starlette.requests import Request
 
+from .metrics_mw import JWKS_REFRESHES, JWT_VERIFY_SECONDS
+
+logger = logging.getLogger(__name__)
+
 
 class AuthConfig(BaseModel):
     jwks_url: str
@@ -61,9 +67,9 @@ def get_authorized_user(
 
         if user is not None:
             return user
-        print("Request authentication returned no user")
+        logger.warning("Request authentication returned no user")
     except Exception as e:
-        print(f"Request authentication failed: {e}")
+        logger.warning("Request authentication failed: %s", e)
 
     if isinstance(request, WebSocket):
         raise WebSocketException(
@@ -75,10 +81,23 @@ def get_authorized_user(
         )
 
 
+class MeteredJWKClient(PyJWKClient):
+    """Counts every fetch of the key set, which happens when its cache expires."""
+
+    def fetch_data(self):
+        try:
+            data = super().fetch_data()
+        except Exception:
+            JWKS_REFRESHES.labels("error").inc()
+            raise
+        JWKS_REFRESHES.labels("ok").inc()
+        return data
+
+
 @functools.cache
 def get_jwks_client(url: str):
     """Reuse client cached by its url, client caches keys by default."""
-    return PyJWKClient(url, cache_keys=True)
+    return MeteredJWKClient(url, cache_keys=True)
 
 
 def get_signing_key(url: str, token: str) -> tuple[str, str]:
@@ -111,7 +130,7 @@ def authorize_websocket(
             break
 
     if not token:
-        print(f"Missing bearer {prefix}.<token> in protocols")
+        logger.info("Missing bearer %s.<token> in protocols", prefix)
         return None
 
     return authorize_token(token, auth_config)
@@ -123,12 +142,12 @@ def authorize_request(
 ) -> User | None:
     auth_header = request.headers.get(auth_config.header)
     if not auth_header:
-        print(f"Missing header '{auth_config.header}'")
+        logger.info("Missing header '%s'", auth_config.header)
         return None
 
     token = auth_header.startswith("Bearer ") and auth_header[7:]
     if not token:
-        print(f"Missing bearer token in '{auth_config.header}'")
+        logger.info("Missing bearer token in '%s'", auth_config.header)
         return None
 
     return authorize_token(token, auth_config)
@@ -146,9 +165,10 @@ def authorize_token(
         try:
             key, alg = get_signing_key(jwks_url, token)
         except Exception as e:
-            print(f"Failed to get signing key {e}")
+            logger.warning("Failed to get signing key %s", e)
             continue
 
+        started = time.perf_counter()
         try:
             payload = jwt.decode(
                 token,
@@ -157,13 +177,15 @@ def authorize_token(
                 audience=audience,
             )
         except jwt.PyJWTError as e:
-            print(f"Failed to decode and validate token {e}")
+            JWT_VERIFY_SECONDS.labels("invalid").observe(time.perf_counter() - started)
+            logger.info("Failed to decode and validate token %s", e)
             continue
+        JWT_VERIFY_SECONDS.labels("ok").observe(time.perf_counter() - started)
 
     try:
         user = User.model_validate(payload)
-        print(f"User {user.sub} authenticated")
+        logger.info("User authenticated", extra={"user_id": user.sub, "sample": True})
         return user
     except Exception as e:
-        print(f"Failed to parse token payload {e}")
+        logger.info("Failed to parse token payload %s", e)
         return None
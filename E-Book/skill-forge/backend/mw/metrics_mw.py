@@ -0,0 +1,144 @@
+"""Prometheus metrics for HTTP requests and authentication, and the /metrics endpoint.
+
+Routes are labelled with their template (e.g. `/routes/assessments/{assessment_id}`)
+rather than the raw path, and requests that match no route share a single
+label, so label cardinality stays bounded.
+
+When PROMETHEUS_MULTIPROC_DIR is set (see serve.py) the endpoint aggregates
+the metrics of all worker processes.
+
+The endpoint is public facing, so it requires `Authorization: Bearer <token>`
+with the token from METRICS_TOKEN, and answers 404 when that isn't set.
+"""
+
+import functools
+import hmac
+import os
+import re
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+UNMATCHED_ROUTE = "unmatched"
+
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+JWT_VERIFY_SECONDS = Histogram(
+    "auth_jwt_verify_seconds",
+    "Time spent verifying bearer tokens",
+    ["outcome"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+JWKS_REFRESHES = Counter(
+    "auth_jwks_refresh_total",
+    "Fetches of the JWKS key set",
+    ["outcome"],
+)
+
+
+# Per app list of (compiled path regex, route template), built on first use
+_route_index: dict[int, list[tuple[re.Pattern, str]]] = {}
+
+
+def route_template(scope: Scope) -> str:
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    if router is None:
+        return UNMATCHED_ROUTE
+
+    index = _route_index.get(id(app))
+    if index is None:
+        index = [
+            (route.path_regex, route.path)
+            for route in router.routes
+            if hasattr(route, "path_regex")
+        ]
+        _route_index[id(app)] = index
+
+    path = scope["path"]
+    for regex, template in index:
+        if regex.match(path):
+            return template
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Records latency and in-flight requests per method and route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+        route = route_template(scope)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = _in_flight_child(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _latency_child(method, route, status).observe(time.perf_counter() - started)
+            in_flight.dec()
+
+
+@functools.cache
+def _in_flight_child(method: str, route: str):
+    return REQUESTS_IN_FLIGHT.labels(method, route)
+
+
+@functools.cache
+def _latency_child(method: str, route: str, status: int):
+    return REQUEST_LATENCY.labels(method, route, str(status))
+
+
+def metrics_endpoint(request: Request) -> Response:
+    token = os.environ.get("METRICS_TOKEN")
+    if not token:
+        return Response(status_code=404)
+    # Headers are latin-1, compared as bytes so any header value is safe
+    supplied = request.headers.get("authorization", "").encode("latin-1")
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode()):
+        return Response(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        data = generate_latest(registry)
+    else:
+        data = generate_latest()
+    return Response(data, media_type=CONTENT_TYPE_LATEST)
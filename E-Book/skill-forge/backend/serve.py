@@ -0,0 +1,105 @@
+"""Production entry point for the backend.
+
+Usage:
+
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N]
+
+Runs `main:app` in several uvicorn worker processes supervised by uvicorn,
+one per available CPU unless WEB_CONCURRENCY or --workers says otherwise.
+A container CPU quota (cgroup cpu.max) caps the default, so a fractional
+CPU plan runs a single worker.
+uvloop and httptools are used when installed. Each worker finishes its
+startup warmup before it starts accepting connections, and on SIGTERM
+workers stop accepting, drain in-flight requests for up to
+GRACEFUL_SHUTDOWN_TIMEOUT seconds and then shut down.
+
+X-Forwarded-For and X-Forwarded-Proto are only trusted from the addresses
+in FORWARDED_ALLOW_IPS (comma separated IPs or networks, default
+127.0.0.1), which should cover the load balancer and nothing else.
+"""
+
+import argparse
+import importlib.util
+import logging
+import math
+import os
+import tempfile
+
+import uvicorn
+from databutton_app.mw.logging_mw import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_quota() -> float | None:
+    """CPUs allowed by the cgroup quota, None when unlimited or unknown."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def default_workers() -> int:
+    if workers := os.environ.get("WEB_CONCURRENCY"):
+        return int(workers)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    if (quota := cpu_quota()) is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+
+def has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the backend with multiple workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    args = parser.parse_args()
+
+    # The supervisor process logs worker starts, deaths and restarts
+    configure_logging()
+
+    loop = "uvloop" if has_module("uvloop") else "asyncio"
+    http = "httptools" if has_module("httptools") else "h11"
+    if args.workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Lets /metrics aggregate across workers, must be set before they start
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+    logger.info(
+        "Starting %d workers on %s:%d", args.workers, args.host, args.port, extra={"loop": loop, "http": http}
+    )
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_SHUTDOWN_TIMEOUT", "25")),
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        # Logging is configured above and by the app, see mw/logging_mw.py
+        log_config=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Report where app startup time goes, per router.
+
+Usage:
+
+    python startup_report.py [--budget-ms 2000] [--top 15]
+
+Imports `main` in a fresh interpreter with `-X importtime` and breaks the
+cumulative import time down by router (`app.apis.*`), by shared library
+(`app.libs.*`) and by the heaviest third party packages. Exits with status
+1 when the total exceeds the budget, so it can gate CI.
+"""
+
+import argparse
+import pathlib
+import re
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = pathlib.Path(__file__).parent
+
+LINE = re.compile(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S+)")
+
+
+def measure() -> tuple[float, list[tuple[str, int]]]:
+    """Return wall time in ms and (module, cumulative_us) per import."""
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"Importing main failed with exit code {proc.returncode}")
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            cumulative, module = match.groups()
+            imports.append((module, int(cumulative)))
+    return wall_ms, imports
+
+
+def print_section(title: str, rows: list[tuple[str, int]]) -> None:
+    print(f"\n{title}")
+    for module, us in rows:
+        print(f"  {us / 1000:9.1f} ms  {module}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    wall_ms, imports = measure()
+    cumulative = {}
+    for module, us in imports:
+        cumulative.setdefault(module, us)
+
+    routers = sorted(
+        ((m, us) for m, us in cumulative.items() if re.fullmatch(r"app\.apis\.\w+", m)),
+        key=lambda r: -r[1],
+    )
+    libs = sorted(
+        ((m, us) for m, us in cumulative.items() if re.fullmatch(r"app\.libs\.\w+", m)),
+        key=lambda r: -r[1],
+    )
+    packages = sorted(
+        ((m, us) for m, us in cumulative.items() if "." not in m and m not in ("app", "main")),
+        key=lambda r: -r[1],
+    )[: args.top]
+
+    print_section("Routers (cumulative, first importer pays for shared modules)", routers)
+    print_section("Libraries", libs)
+    print_section(f"Heaviest packages (top {args.top})", packages)
+
+    main_us = cumulative.get("main", 0)
+    print(f"\nimport main: {main_us / 1000:.1f} ms, process wall time: {wall_ms:.1f} ms")
+
+    if args.budget_ms is not None and main_us / 1000 > args.budget_ms:
+        print(f"Startup budget exceeded: {main_us / 1000:.1f} ms > {args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())